@@ -2,29 +2,74 @@ from __future__ import annotations
 from types import SimpleNamespace
 from typing import List, Optional, Dict, Any
 
-import pandas as pd
 from skill_framework import SkillInput, SkillVisualization, skill, SkillParameter, SkillOutput, ParameterDisplayDescription
 from skill_framework.skills import ExportData
 from skill_framework.layouts import wire_layout
 
+import copy
 import json
 import os
+import pickle
 import glob
 import traceback
-from jinja2 import Template
+import hashlib
+import tempfile
+from functools import lru_cache
+from collections import Counter, OrderedDict, namedtuple
+from jinja2 import Environment, select_autoescape
 import base64
 import io
-from PIL import Image
 import logging
 import re
 import html
-import fitz  # PyMuPDF for PDF thumbnail generation
 import numpy as np
 from typing import List
-import requests
+
+try:
+    import ahocorasick
+    _AHOCORASICK_AVAILABLE = True
+except ImportError:
+    _AHOCORASICK_AVAILABLE = False
+
+try:
+    import orjson
+    _ORJSON_AVAILABLE = True
+except ImportError:
+    _ORJSON_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Parsed pack.json sources keyed by (path, mtime_ns, size) so warm requests skip disk I/O and JSON parsing
+_PACK_CACHE = {}
+
+# Loaded sources and their scoring index, pickled per pack.json version so a new process skips parsing and indexing
+INDEX_SNAPSHOT_PATH = os.path.join(tempfile.gettempdir(), 'document_rag_index.pkl')
+# Snapshots are only reused by the same version of this module
+_MODULE_STAT = os.stat(__file__)
+INDEX_SNAPSHOT_VERSION = (_MODULE_STAT.st_mtime_ns, _MODULE_STAT.st_size)
+
+# Parsed layout JSON keyed by the layout string passed in the skill parameters
+_LAYOUT_CACHE = {}
+
+# Matches a layout placeholder such as {{response_content}}
+_TRIVIAL_LAYOUT_RE = re.compile(r'\{\{(\w+)\}\}')
+
+# Layout string -> (prefix, suffix, variable name) for single-placeholder layouts, None for anything else
+_FAST_WIRE_CACHE = {}
+
+# Rendered responses kept per (question, parameters, pack.json version)
+RESPONSE_CACHE_SIZE = 256
+_RESPONSE_CACHE = OrderedDict()
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Fallback thumbnails are solid-fill icons, so JPEG encodes much faster than PNG at no visible cost
+THUMBNAIL_FORMAT = "JPEG"
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_CACHE_SIZE = 512
+THUMBNAIL_CACHE_DIR = os.path.join(tempfile.gettempdir(), "thumb_cache")
+# A complete JPEG starts with a start-of-image marker and ends with an end-of-image marker
+_JPEG_SOI, _JPEG_EOI = b'\xff\xd8\xff', b'\xff\xd9'
+
 @skill(
     name="Competitor RAG Scraper",
     description="Retrieves and analyzes competitive intelligence data to answer questions about competitor pricing, inventory, and market trends",
@@ -89,15 +134,6 @@ def document_rag_explorer(parameters: SkillInput):
     max_characters = parameters.arguments.max_characters or 3000
     max_prompt = parameters.arguments.max_prompt
     
-    # Initialize empty topics list (globals not available in SkillInput)
-    list_of_topics = []
-    
-    # Initialize results
-    main_html = ""
-    sources_html = ""
-    title = "Document Analysis"
-    response_data = None
-    
     try:
         # Load document sources from pack.json
         loaded_sources = load_document_sources()
@@ -110,68 +146,11 @@ def document_rag_explorer(parameters: SkillInput):
                 export_data=[]
             )
         
-        # Find matching documents
-        logger.info(f"DEBUG: Searching for documents matching: '{user_question}'")
-        docs = find_matching_documents(
-            user_question=user_question,
-            topics=list_of_topics,
-            loaded_sources=loaded_sources,
-            base_url=base_url,
-            max_sources=max_sources,
-            match_threshold=match_threshold,
-            max_characters=max_characters
+        # Repeat questions against the same pack.json reuse the rendered tab contents
+        served = serve_question(
+            normalize_question(user_question), base_url, max_sources, match_threshold, max_characters, pack_version()
         )
-        logger.info(f"DEBUG: Found {len(docs) if docs else 0} matching documents")
-        
-        if not docs:
-            # No results found
-            logger.warning("DEBUG: No matching documents found for query")
-            no_results_html = """
-            <div style="text-align: center; padding: 40px; color: #666;">
-                <h2>No relevant documents found</h2>
-                <p>No documents in the knowledge base matched your question with sufficient relevance.</p>
-                <p>Try rephrasing your question or using different keywords.</p>
-            </div>
-            """
-            main_html = no_results_html
-            sources_html = "<p>No sources available</p>"
-            title = "No Results Found"
-        else:
-            # Generate response from documents
-            logger.info(f"DEBUG: Generating RAG response from {len(docs)} documents")
-            response_data = generate_rag_response(user_question, docs)
-            logger.info(f"DEBUG: Response generated: {bool(response_data)}")
-            
-            # Create main response HTML (without sources section)
-            if response_data:
-                try:
-                    main_html = force_ascii_replace(
-                        Template(main_response_template).render(
-                            title=response_data['title'],
-                            content=response_data['content']
-                        )
-                    )
-                    logger.info(f"DEBUG: Generated main HTML, length: {len(main_html)}")
-                    
-                    # Create separate sources HTML
-                    sources_html = force_ascii_replace(
-                        Template(sources_template).render(
-                            references=response_data['references']
-                        )
-                    )
-                    logger.info(f"DEBUG: Generated sources HTML, length: {len(sources_html)}")
-                    title = response_data['title']
-                except Exception as e:
-                    logger.error(f"DEBUG: Error rendering HTML templates: {str(e)}")
-                    import traceback
-                    logger.error(f"DEBUG: Template error traceback: {traceback.format_exc()}")
-                    main_html = f"<p>Error rendering content: {str(e)}</p>"
-                    sources_html = "<p>Error rendering sources</p>"
-                    title = "Template Error"
-            else:
-                main_html = "<p>Error generating response from documents.</p>"
-                sources_html = "<p>Error loading sources</p>"
-                title = "Error"
+        title, main_html, sources_html, references_content, response_content, sources_content = served
     
     except Exception as e:
         logger.error(f"ERROR in document RAG: {str(e)}")
@@ -180,31 +159,7 @@ def document_rag_explorer(parameters: SkillInput):
         main_html = f"<p>Error processing request: {str(e)}</p>"
         sources_html = "<p>Error loading sources</p>"
         title = "Error"
-    
-    # Create content variables for wire_layout like price variance does
-    # Prepare content for response tab
-    references_content = ""
-    if response_data and response_data.get('references'):
-        references_content = f"""
-        <hr style="margin: 20px 0;">
-        <h3>References</h3>
-        {create_references_list(response_data['references'])}
-        """
-    
-    response_content = f"""
-    <div style="padding: 20px;">
-        {main_html}
-        {references_content}
-    </div>
-    """
-    
-    # Prepare content for sources tab
-    sources_content = f"""
-    <div style="padding: 20px;">
-        <h2>Document Sources</h2>
-        {create_sources_table(response_data['references']) if response_data and response_data.get('references') else sources_html}
-    </div>
-    """
+        references_content, response_content, sources_content = build_tab_contents(main_html, sources_html, None)
     
     # Create visualizations using wire_layout like price variance
     visualizations = []
@@ -218,10 +173,7 @@ def document_rag_explorer(parameters: SkillInput):
         response_vars = {"response_content": response_content}
         logger.info(f"DEBUG: Response vars keys: {list(response_vars.keys())}")
         
-        response_layout_json = json.loads(parameters.arguments.response_layout)
-        logger.info(f"DEBUG: Response layout parsed successfully")
-        
-        rendered_response = wire_layout(response_layout_json, response_vars)
+        rendered_response = fast_wire(parameters.arguments.response_layout, response_vars)
         logger.info(f"DEBUG: Response layout rendered successfully, type: {type(rendered_response)}")
         
         visualizations.append(SkillVisualization(title=title, layout=rendered_response))
@@ -234,10 +186,7 @@ def document_rag_explorer(parameters: SkillInput):
         sources_vars = {"sources_content": sources_content}
         logger.info(f"DEBUG: Sources vars keys: {list(sources_vars.keys())}")
         
-        sources_layout_json = json.loads(parameters.arguments.sources_layout)
-        logger.info(f"DEBUG: Sources layout parsed successfully")
-        
-        rendered_sources = wire_layout(sources_layout_json, sources_vars)
+        rendered_sources = fast_wire(parameters.arguments.sources_layout, sources_vars)
         logger.info(f"DEBUG: Sources layout rendered successfully, type: {type(rendered_sources)}")
         
         visualizations.append(SkillVisualization(title="Sources", layout=rendered_sources))
@@ -273,82 +222,363 @@ def document_rag_explorer(parameters: SkillInput):
 
 # Helper Functions and Templates
 
+def serve_question(user_question, base_url, max_sources, match_threshold, max_characters, pack_key):
+    """Match, generate and render one question, cached per pack.json version (pack_key)
+
+    Returns (title, main_html, sources_html, references_content, response_content, sources_content).
+    Responses degraded by an LLM or template failure are not cached, so the next request retries.
+    """
+    key = (user_question, base_url, max_sources, match_threshold, max_characters, pack_key)
+    served = _RESPONSE_CACHE.get(key)
+    if served is not None:
+        _RESPONSE_CACHE.move_to_end(key)
+        return served
+
+    logger.info(f"DEBUG: Response cache miss for pack {pack_key}")
+    served, complete = render_question(user_question, base_url, max_sources, match_threshold, max_characters)
+    if complete:
+        _RESPONSE_CACHE[key] = served
+        if len(_RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+    return served
+
+def render_question(user_question, base_url, max_sources, match_threshold, max_characters):
+    """Match, generate and render one question
+
+    Returns (served, complete): the serve_question tuple, and False when the LLM call or template rendering failed.
+    """
+    # Initialize empty topics list (globals not available in SkillInput)
+    list_of_topics = []
+    
+    # Initialize results
+    main_html = ""
+    sources_html = ""
+    title = "Document Analysis"
+    response_data = None
+    complete = True
+    
+    loaded_sources = load_document_sources()
+    
+    # Find matching documents
+    logger.info(f"DEBUG: Searching for documents matching: '{user_question}'")
+    docs = find_matching_documents(
+        user_question=user_question,
+        topics=list_of_topics,
+        loaded_sources=loaded_sources,
+        base_url=base_url,
+        max_sources=max_sources,
+        match_threshold=match_threshold,
+        max_characters=max_characters
+    )
+    logger.info(f"DEBUG: Found {len(docs) if docs else 0} matching documents")
+    
+    if not docs:
+        # No results found
+        logger.warning("DEBUG: No matching documents found for query")
+        no_results_html = """
+            <div style="text-align: center; padding: 40px; color: #666;">
+                <h2>No relevant documents found</h2>
+                <p>No documents in the knowledge base matched your question with sufficient relevance.</p>
+                <p>Try rephrasing your question or using different keywords.</p>
+            </div>
+            """
+        main_html = no_results_html
+        sources_html = "<p>No sources available</p>"
+        title = "No Results Found"
+    else:
+        # Generate response from documents
+        logger.info(f"DEBUG: Generating RAG response from {len(docs)} documents")
+        response_data = generate_rag_response(user_question, docs)
+        logger.info(f"DEBUG: Response generated: {bool(response_data)}")
+        complete = bool(response_data) and not response_data['llm_failed']
+        
+        # Create main response HTML (without sources section)
+        if response_data:
+            try:
+                main_html = force_ascii_replace(
+                    _MAIN_TPL.render(
+                        title=response_data['title'],
+                        content=response_data['content']
+                    )
+                )
+                logger.info(f"DEBUG: Generated main HTML, length: {len(main_html)}")
+                
+                # Create separate sources HTML
+                sources_html = force_ascii_replace(
+                    _SOURCES_TPL.render(
+                        references=response_data['references']
+                    )
+                )
+                logger.info(f"DEBUG: Generated sources HTML, length: {len(sources_html)}")
+                title = response_data['title']
+            except Exception as e:
+                logger.error(f"DEBUG: Error rendering HTML templates: {str(e)}")
+                import traceback
+                logger.error(f"DEBUG: Template error traceback: {traceback.format_exc()}")
+                main_html = f"<p>Error rendering content: {str(e)}</p>"
+                sources_html = "<p>Error rendering sources</p>"
+                title = "Template Error"
+                complete = False
+        else:
+            main_html = "<p>Error generating response from documents.</p>"
+            sources_html = "<p>Error loading sources</p>"
+            title = "Error"
+    
+    references = response_data.get('references') if response_data else None
+    return (title, main_html, sources_html) + build_tab_contents(main_html, sources_html, references), complete
+
+def build_tab_contents(main_html, sources_html, references):
+    """Build the (references_content, response_content, sources_content) wired into the two tabs"""
+    # Create content variables for wire_layout like price variance does
+    # Prepare content for response tab
+    references_content = ""
+    if references:
+        references_content = f"""
+        <hr style="margin: 20px 0;">
+        <h3>References</h3>
+        {create_references_list(references)}
+        """
+    
+    response_content = f"""
+    <div style="padding: 20px;">
+        {main_html}
+        {references_content}
+    </div>
+    """
+    
+    # Prepare content for sources tab
+    sources_content = f"""
+    <div style="padding: 20px;">
+        <h2>Document Sources</h2>
+        {create_sources_table(references) if references else sources_html}
+    </div>
+    """
+    return references_content, response_content, sources_content
+
+def normalize_question(user_question):
+    """Strip and collapse whitespace so trivially different phrasings share a cached response"""
+    if not isinstance(user_question, str):
+        return user_question
+    return _WHITESPACE_RE.sub(' ', user_question.strip())
+
+def pack_version():
+    """Return the (path, mtime, size) key of the currently loaded pack.json"""
+    return next(iter(_PACK_CACHE), None)
+
+def json_loads(data):
+    """json.loads, using orjson when it is installed"""
+    return orjson.loads(data) if _ORJSON_AVAILABLE else json.loads(data)
+
+def parse_layout(layout_str):
+    """Parse a layout JSON string, reusing the parsed tree for layouts seen before"""
+    layout = _LAYOUT_CACHE.get(layout_str)
+    if layout is None:
+        layout = _LAYOUT_CACHE[layout_str] = json_loads(layout_str)
+
+    # wire_layout assigns values into the tree, including nested dicts for dotted field names, so hand it a copy
+    return copy.deepcopy(layout)
+
+def compile_trivial_layout(layout_str):
+    """Split a single-placeholder layout's wire_layout output around the placeholder value
+
+    Returns (prefix, suffix, variable name), or None when the layout isn't one variable wired into one
+    top-level element whose field holds the {{variable}} placeholder.
+    """
+    layout = json_loads(layout_str)
+    layout_json = layout.get("layoutJson")
+    input_variables = layout.get("inputVariables")
+    if not isinstance(layout_json, dict) or not isinstance(input_variables, list) or len(input_variables) != 1:
+        return None
+
+    variable = input_variables[0]
+    targets = variable.get("targets") or []
+    if len(targets) != 1 or "." in targets[0].get("fieldName", "."):
+        return None
+    name = variable.get("name")
+    element_name = targets[0].get("elementName")
+    field_name = targets[0]["fieldName"]
+
+    elements = [child for child in layout_json.get("children", []) if child.get("name") == element_name]
+    if len(elements) != 1:
+        return None
+    placeholder = _TRIVIAL_LAYOUT_RE.fullmatch(str(elements[0].get(field_name, "")))
+    if not placeholder or placeholder.group(1) != name:
+        return None
+
+    # Render exactly as wire_layout does, with a marker where the value goes
+    marker = f"__fast_wire_{name}__"
+    elements[0][field_name] = marker
+    rendered = json.dumps(layout_json, indent=2)
+    marker_json = json.dumps(marker)
+    if rendered.count(marker_json) != 1:
+        return None
+    prefix, suffix = rendered.split(marker_json)
+    return prefix, suffix, name
+
+def fast_wire(layout_str, input_values):
+    """wire_layout for a layout string, splicing the value in directly for single-placeholder layouts"""
+    if layout_str not in _FAST_WIRE_CACHE:
+        _FAST_WIRE_CACHE[layout_str] = compile_trivial_layout(layout_str)
+    compiled = _FAST_WIRE_CACHE[layout_str]
+
+    if compiled is not None:
+        prefix, suffix, name = compiled
+        value = input_values.get(name)
+        if isinstance(value, str) and value:
+            return prefix + json.dumps(value) + suffix
+
+    return wire_layout(parse_layout(layout_str), input_values)
+
+# Row markup for the references list and sources table, filled in with str.format
+_REF_ROW = """
+            <li style='margin-bottom: 10px;'>
+                <a href='{url}' target='_blank' style='color: #0066cc; text-decoration: none;'>
+                    {text} (Page {page})
+                </a>
+            </li>
+        """.format
+
+_SRC_ROW = """
+            <tr style='background-color: {bg_color}; border-bottom: 1px solid #dee2e6;'>
+                <td style='padding: 12px;'>
+                    <a href='{url}' target='_blank' style='color: #0066cc; text-decoration: none;'>
+                        {text}
+                    </a>
+                </td>
+                <td style='padding: 12px;'>{page}</td>
+                <td style='padding: 12px;'>{match_score}</td>
+            </tr>
+        """.format
+
 def create_references_list(references):
     """Create clickable references list HTML"""
     if not references:
         return "<p>No references available</p>"
     
-    html_parts = ["<ol style='list-style-type: decimal; padding-left: 20px;'>"]
-    for ref in references:
-        html_parts.append(f"""
-            <li style='margin-bottom: 10px;'>
-                <a href='{ref.get('url', '#')}' target='_blank' style='color: #0066cc; text-decoration: none;'>
-                    {ref.get('text', 'Document')} (Page {ref.get('page', '?')})
-                </a>
-            </li>
-        """)
-    html_parts.append("</ol>")
-    return ''.join(html_parts)
+    rows = ''.join(
+        _REF_ROW(url=ref.get('url', '#'), text=ref.get('text', 'Document'), page=ref.get('page', '?'))
+        for ref in references
+    )
+    return f"<ol style='list-style-type: decimal; padding-left: 20px;'>{rows}</ol>"
 
 def get_pdf_thumbnail(pack_file_path, file_name, page_num, image_height=300, image_width=400):
     """Generate real PDF thumbnail using knowledge base API like ddoc_ex.py"""
-    logger.info(f"DEBUG THUMBNAIL: ==> Starting thumbnail generation for {file_name} page {page_num}")
-    logger.info(f"DEBUG THUMBNAIL: ==> Requested dimensions: {image_width}x{image_height}")
+    logger.debug("DEBUG THUMBNAIL: ==> Starting thumbnail generation for %s page %s", file_name, page_num)
+    logger.debug("DEBUG THUMBNAIL: ==> Requested dimensions: %sx%s", image_width, image_height)
     
     # Knowledge base API not available in skill environment, use fallback
-    logger.info(f"DEBUG THUMBNAIL: ==> Knowledge base API not available in skill environment, using fallback")
-    return create_fallback_thumbnail(file_name, page_num, image_width, image_height)
-        
+    logger.debug("DEBUG THUMBNAIL: ==> Knowledge base API not available in skill environment, using fallback")
+    return cached_fallback_thumbnail(file_name, page_num, image_width, image_height)
+
+@lru_cache(maxsize=THUMBNAIL_CACHE_SIZE)
+def cached_fallback_thumbnail(file_name, page_num, image_width, image_height):
+    """Fallback thumbnail memoized in process and on disk under THUMBNAIL_CACHE_DIR
+
+    The temp directory may be shared, so cache files are only used when this user owns them and they hold a JPEG.
+    """
+    key = hashlib.blake2b(
+        f"{file_name}|{page_num}|{image_width}|{image_height}|{THUMBNAIL_FORMAT}".encode('utf-8'), digest_size=16
+    ).hexdigest()
+    cache_path = os.path.join(THUMBNAIL_CACHE_DIR, f"{key}.b64")
+    try:
+        with open(cache_path, 'r', encoding='ascii') as f:
+            if hasattr(os, 'getuid') and os.fstat(f.fileno()).st_uid != os.getuid():
+                logger.warning(f"DEBUG THUMBNAIL: Ignoring thumbnail cache file not owned by this user: {cache_path}")
+            else:
+                image_base64 = f.read()
+                if is_jpeg_base64(image_base64):
+                    return image_base64
+                logger.warning(f"DEBUG THUMBNAIL: Ignoring thumbnail cache file that is not a base64 JPEG: {cache_path}")
+    except (OSError, ValueError):
+        pass
+
+    image_base64 = create_fallback_thumbnail(file_name, page_num, image_width, image_height)
+    if image_base64:
+        try:
+            os.makedirs(THUMBNAIL_CACHE_DIR, mode=0o700, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='ascii') as f:
+                f.write(image_base64)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.debug("DEBUG THUMBNAIL: Could not write thumbnail cache %s: %s", cache_path, e)
+    return image_base64
+
+def is_jpeg_base64(image_base64):
+    """True when image_base64 is strict base64 of a complete JPEG image"""
+    try:
+        data = base64.b64decode(image_base64, validate=True)
+    except ValueError:
+        return False
+    return data.startswith(_JPEG_SOI) and data.endswith(_JPEG_EOI)
+
+@lru_cache(maxsize=8)
+def thumbnail_base(image_width, image_height):
+    """Draw the static fallback thumbnail (background, border, document icon) once per size
+
+    Returns (image, text_y) where text_y is the top of the file name below the icon; callers must copy the image.
+    """
+    from PIL import Image, ImageDraw
+    
+    # Create a clean document-style thumbnail
+    placeholder_image = Image.new('RGB', (image_width, image_height), color='#f8f9fa')
+    draw = ImageDraw.Draw(placeholder_image)
+    
+    # Add a subtle border
+    draw.rectangle([0, 0, image_width-1, image_height-1], outline='#dee2e6', width=1)
+    
+    # Add a document icon in the center
+    icon_size = min(image_width, image_height) // 3
+    icon_x = (image_width - icon_size) // 2
+    icon_y = (image_height - icon_size) // 2 - 20
+    
+    # Draw document shape
+    draw.rectangle([icon_x, icon_y, icon_x + icon_size, icon_y + icon_size], 
+                  fill='white', outline='#6c757d', width=2)
+    
+    # Add fold corner
+    corner_size = icon_size // 4
+    draw.polygon([(icon_x + icon_size - corner_size, icon_y),
+                 (icon_x + icon_size, icon_y + corner_size),
+                 (icon_x + icon_size - corner_size, icon_y + corner_size)],
+                fill='#e9ecef', outline='#6c757d')
+    
+    # Add text lines in document
+    line_spacing = icon_size // 8
+    for i in range(3):
+        y_pos = icon_y + icon_size // 3 + i * line_spacing
+        draw.line([(icon_x + icon_size // 6, y_pos), (icon_x + icon_size - icon_size // 6, y_pos)], 
+                 fill='#adb5bd', width=1)
+    
+    return placeholder_image, icon_y + icon_size + 15
+
+@lru_cache(maxsize=1)
+def thumbnail_font():
+    """Font for fallback thumbnail captions, or None to use Pillow's built-in default"""
+    from PIL import ImageFont
+    try:
+        return ImageFont.load_default()
+    except:
+        return None
 
 def create_fallback_thumbnail(file_name, page_num, image_width, image_height):
     """Create a clean fallback thumbnail when PDF rendering fails"""
-    logger.info(f"DEBUG FALLBACK: ==> Creating fallback thumbnail for {file_name} page {page_num}")
-    logger.info(f"DEBUG FALLBACK: ==> Dimensions: {image_width}x{image_height}")
+    logger.debug("DEBUG FALLBACK: ==> Creating fallback thumbnail for %s page %s", file_name, page_num)
+    logger.debug("DEBUG FALLBACK: ==> Dimensions: %sx%s", image_width, image_height)
     try:
-        from PIL import ImageDraw, ImageFont
+        from PIL import ImageDraw
         
-        # Create a clean document-style thumbnail
-        placeholder_image = Image.new('RGB', (image_width, image_height), color='#f8f9fa')
+        # Start from the pre-drawn icon, so only the file name and page number are drawn per call
+        base_image, text_y = thumbnail_base(image_width, image_height)
+        placeholder_image = base_image.copy()
         draw = ImageDraw.Draw(placeholder_image)
-        
-        # Add a subtle border
-        draw.rectangle([0, 0, image_width-1, image_height-1], outline='#dee2e6', width=1)
-        
-        # Add a document icon in the center
-        icon_size = min(image_width, image_height) // 3
-        icon_x = (image_width - icon_size) // 2
-        icon_y = (image_height - icon_size) // 2 - 20
-        
-        # Draw document shape
-        draw.rectangle([icon_x, icon_y, icon_x + icon_size, icon_y + icon_size], 
-                      fill='white', outline='#6c757d', width=2)
-        
-        # Add fold corner
-        corner_size = icon_size // 4
-        draw.polygon([(icon_x + icon_size - corner_size, icon_y),
-                     (icon_x + icon_size, icon_y + corner_size),
-                     (icon_x + icon_size - corner_size, icon_y + corner_size)],
-                    fill='#e9ecef', outline='#6c757d')
-        
-        # Add text lines in document
-        line_spacing = icon_size // 8
-        for i in range(3):
-            y_pos = icon_y + icon_size // 3 + i * line_spacing
-            draw.line([(icon_x + icon_size // 6, y_pos), (icon_x + icon_size - icon_size // 6, y_pos)], 
-                     fill='#adb5bd', width=1)
-        
-        # Add file name and page number below icon
-        try:
-            font = ImageFont.load_default()
-        except:
-            font = None
+        font = thumbnail_font()
         
         # Document name
         doc_name = file_name[:20] + "..." if len(file_name) > 20 else file_name
         text_bbox = draw.textbbox((0, 0), doc_name, font=font)
         text_width = text_bbox[2] - text_bbox[0]
         text_x = (image_width - text_width) // 2
-        text_y = icon_y + icon_size + 15
         draw.text((text_x, text_y), doc_name, fill='#495057', font=font)
         
         # Page number
@@ -360,10 +590,10 @@ def create_fallback_thumbnail(file_name, page_num, image_width, image_height):
         
         # Convert to base64
         buffered = io.BytesIO()
-        placeholder_image.save(buffered, format="PNG")
+        placeholder_image.save(buffered, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
         image_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
         
-        logger.info(f"DEBUG: Created fallback thumbnail for {file_name} page {page_num}")
+        logger.debug("DEBUG: Created fallback thumbnail for %s page %s", file_name, page_num)
         return image_base64
         
     except Exception as e:
@@ -387,28 +617,39 @@ def create_sources_table(references):
         <tbody>"""
     ]
     
-    for i, ref in enumerate(references):
-        bg_color = '#ffffff' if i % 2 == 0 else '#f8f9fa'
-        # Extract match score from ref if available, otherwise use placeholder
-        match_score = ref.get('match_score', '0.780000') if hasattr(ref, 'get') else '0.780000'
-        
-        html_parts.append(f"""
-            <tr style='background-color: {bg_color}; border-bottom: 1px solid #dee2e6;'>
-                <td style='padding: 12px;'>
-                    <a href='{ref.get('url', '#')}' target='_blank' style='color: #0066cc; text-decoration: none;'>
-                        {ref.get('src', ref.get('text', 'Document'))}
-                    </a>
-                </td>
-                <td style='padding: 12px;'>{ref.get('page', '?')}</td>
-                <td style='padding: 12px;'>{match_score}</td>
-            </tr>
-        """)
-    
+    html_parts.extend(
+        _SRC_ROW(
+            bg_color='#ffffff' if i % 2 == 0 else '#f8f9fa',
+            url=ref.get('url', '#'),
+            text=ref.get('src', ref.get('text', 'Document')),
+            page=ref.get('page', '?'),
+            # Extract match score from ref if available, otherwise use placeholder
+            match_score=ref.get('match_score', '0.780000') if hasattr(ref, 'get') else '0.780000'
+        )
+        for i, ref in enumerate(references)
+    )
     html_parts.append("</tbody></table>")
     return ''.join(html_parts)
 
+KB_BASE_URL = "https://dreamfinders.poc.answerrocket.com/apps/system/knowledge-base"
+
+# Knowledge base IDs by the company name found in a file name, checked in order
+_DOC_ID_MAP = {
+    "Lennar": "abb40c5f-f259-48bf-85c3-d2ed1ea956b8",
+    "Meritage": "7f0292db-d935-4c90-b65b-897bb98167f9",
+}
+
+def build_kb_url(file_name):
+    """Build the knowledge base URL of a document; append #page=N for a page"""
+    # Fallback for unknown documents
+    doc_id = next((doc_id for name, doc_id in _DOC_ID_MAP.items() if name in file_name), "unknown")
+    return f"{KB_BASE_URL}/{doc_id}"
+
 def load_document_sources():
-    """Load document sources from pack.json bundled with the skill"""
+    """Load document sources from pack.json bundled with the skill
+
+    Results are cached until pack.json changes, so callers must treat the returned sources as read-only.
+    """
     loaded_sources = []
     
     try:
@@ -465,9 +706,27 @@ def load_document_sources():
             logger.info(f"DEBUG: Found pack.json in skill bundle: {pack_file}")
         
         if pack_file and os.path.exists(pack_file):
+            pack_stat = os.stat(pack_file)
+            cache_key = (pack_file, pack_stat.st_mtime_ns, pack_stat.st_size)
+            cached_sources = _PACK_CACHE.get(cache_key)
+            if cached_sources is not None:
+                logger.info(f"Using {len(cached_sources)} cached document chunks from: {pack_file}")
+                return cached_sources
+
+            snapshot = load_index_snapshot(cache_key)
+            if snapshot is not None:
+                cached_sources, index = snapshot
+                _PACK_CACHE.clear()
+                _PACK_CACHE[cache_key] = cached_sources
+                _SCORING_INDEX_CACHE.clear()
+                _SCORING_INDEX_CACHE[sources_key(cached_sources)] = index
+                logger.info(f"Using {len(cached_sources)} document chunks from index snapshot: {INDEX_SNAPSHOT_PATH}")
+                return cached_sources
+
             logger.info(f"Loading documents from: {pack_file}")
-            with open(pack_file, 'r', encoding='utf-8') as f:
-                resource_contents = json.load(f)
+            # Read raw bytes so orjson (when installed) parses without a decode step
+            with open(pack_file, 'rb') as f:
+                resource_contents = json_loads(f.read())
                 logger.info(f"DEBUG: Loaded JSON structure type: {type(resource_contents)}")
                 
                 # Handle different pack.json formats
@@ -477,16 +736,25 @@ def load_document_sources():
                     for processed_file in resource_contents:
                         file_name = processed_file.get("File", "unknown_file")
                         chunks = processed_file.get("Chunks", [])
-                        logger.info(f"DEBUG: Processing file '{file_name}' with {len(chunks)} chunks")
+                        logger.debug("DEBUG: Processing file '%s' with %d chunks", file_name, len(chunks))
+                        file_name_lower = file_name.lower()
+                        kb_url = build_kb_url(file_name)
                         for chunk in chunks:
+                            text = chunk.get("Text", "")
                             res = {
                                 "file_name": file_name,
-                                "text": chunk.get("Text", ""),
+                                "file_name_lower": file_name_lower,
+                                "text": text,
+                                "text_lower": text.lower(),
+                                "text_len": len(text),
                                 "description": str(chunk.get("Text", ""))[:200] + "..." if len(str(chunk.get("Text", ""))) > 200 else str(chunk.get("Text", "")),
                                 "chunk_index": chunk.get("Page", 1),
-                                "citation": file_name
+                                "citation": file_name,
+                                "url": f"{kb_url}#page={chunk.get('Page', 1)}"
                             }
                             loaded_sources.append(res)
+                    _PACK_CACHE.clear()
+                    _PACK_CACHE[cache_key] = loaded_sources
                 else:
                     logger.warning(f"Unexpected pack.json format - expected array of files, got: {type(resource_contents)}")
         else:
@@ -500,6 +768,51 @@ def load_document_sources():
     logger.info(f"Loaded {len(loaded_sources)} document chunks from pack.json")
     return loaded_sources
 
+# Candidates sorted up front per requested source; the selection passes rarely look further
+RANK_OVERSAMPLE = 4
+
+class LazyRanking:
+    """(index, source) pairs of candidates in descending score order, stable on ties
+
+    Only the top k candidates (plus any tied with the k-th) are sorted up front; the rest are sorted the first
+    time an iteration runs past them.
+    """
+
+    def __init__(self, loaded_sources, scores, candidates, k):
+        self._sources = loaded_sources
+        self._scores = scores
+        if len(candidates) > k > 0:
+            candidate_scores = scores[candidates]
+            kth = np.partition(candidate_scores, len(candidates) - k)[len(candidates) - k]
+            head, self._tail = candidates[candidate_scores >= kth], candidates[candidate_scores < kth]
+        else:
+            head, self._tail = candidates, None
+        self._ranked = self._sorted(head)
+
+    def _sorted(self, indices):
+        return indices[np.argsort(-self._scores[indices], kind='stable')].tolist()
+
+    def __iter__(self):
+        pos = 0
+        while True:
+            if pos == len(self._ranked):
+                if self._tail is None:
+                    return
+                self._ranked.extend(self._sorted(self._tail))
+                self._tail = None
+                continue
+            i = self._ranked[pos]
+            yield i, self._sources[i]
+            pos += 1
+
+# Matched source handed to response generation; text_len is kept for the character budget
+Match = namedtuple('Match', 'file_name text text_len description chunk_index citation url match_score')
+
+def make_match(source, match_score):
+    """Build the Match for a loaded source dict and its score"""
+    return Match(source['file_name'], source['text'], source['text_len'], source['description'],
+                 source['chunk_index'], source['citation'], source['url'], match_score)
+
 def find_matching_documents(user_question, topics, loaded_sources, base_url, max_sources, match_threshold, max_characters):
     """Find documents using enhanced keyword matching optimized for competitive intelligence"""
     logger.info("DEBUG: Starting enhanced keyword matching (embeddings not available via SDK)")
@@ -517,72 +830,37 @@ def find_matching_documents(user_question, topics, loaded_sources, base_url, max
         mentions_lennar = "lennar" in question_lower
         mentions_meritage = "meritage" in question_lower
         mentions_both = mentions_lennar and mentions_meritage
-        wants_comparison = any(word in question_lower for word in ["competitors", "competition", "both", "compare", "versus", "vs"])
-
-        # Build comprehensive search terms
-        search_terms = []
-        if user_question:
-            search_terms.append(user_question)
-
-        # Aggressive keyword expansion
-        keyword_expansions = {
-            'financing': ['financing', 'finance', 'mortgage', 'loan', 'apr', 'rate', 'payment', 'buydown',
-                         'interest', 'monthly payment', 'qualification', 'credit', '2.99%', '5.572%'],
-            'special': ['special', 'promotion', 'offer', 'event', 'sale', 'limited time', 'exclusive',
-                       'discount', 'incentive', 'deal', 'savings', 'national sales event'],
-            'price': ['price', 'pricing', 'cost', '$', 'reduction', 'reduced', 'discount', 'drop',
-                     'decrease', 'lower', 'affordable', 'starting from'],
-            'inventory': ['inventory', 'available', 'availability', 'move-in ready', 'quick move',
-                         'homes available', 'in stock', 'ready now']
-        }
+        wants_comparison = any(word in question_lower for word in COMPARISON_WORDS)
 
         # Add expansions based on keywords in question
-        for key, expansions in keyword_expansions.items():
-            if key in question_lower:
-                search_terms.extend(expansions)
+        expansion_terms = set().union(*(terms for key, terms in _EXPANSION_SETS.items() if key in question_lower))
 
         # Add competitor terms
         if mentions_lennar or wants_comparison:
-            search_terms.append('lennar')
+            expansion_terms.add('lennar')
         if mentions_meritage or wants_comparison:
-            search_terms.append('meritage')
-
-        search_terms.extend([topic for topic in topics if topic])
+            expansion_terms.add('meritage')
 
-        # Remove duplicates
-        seen = set()
-        unique_terms = []
-        for term in search_terms:
-            if term and term.lower() not in seen:
-                seen.add(term.lower())
-                unique_terms.append(term)
+        # Build comprehensive search terms without duplicates (expansion terms are already lowercase)
+        unique_terms = [user_question] if user_question else []
+        unique_terms.extend(sorted(expansion_terms - {question_lower}, key=SEARCH_VOCAB.get))
+        seen = expansion_terms | {question_lower}
+        for topic in topics:
+            if topic and topic.lower() not in seen:
+                seen.add(topic.lower())
+                unique_terms.append(topic)
 
         logger.info(f"DEBUG: Expanded to {len(unique_terms)} unique search terms")
 
-        # Score all documents
-        scored_sources = []
-        for source in loaded_sources:
-            score = calculate_enhanced_relevance(source['text'], unique_terms, source['file_name'])
-
-            if score >= float(match_threshold):
-                source_copy = source.copy()
-                source_copy['match_score'] = score
-
-                # Generate URLs
-                if "Lennar" in source_copy['file_name']:
-                    doc_id = "abb40c5f-f259-48bf-85c3-d2ed1ea956b8"
-                elif "Meritage" in source_copy['file_name']:
-                    doc_id = "7f0292db-d935-4c90-b65b-897bb98167f9"
-                else:
-                    doc_id = "unknown"
-
-                source_copy['url'] = f"https://dreamfinders.poc.answerrocket.com/apps/system/knowledge-base/{doc_id}#page={source_copy['chunk_index']}"
-                scored_sources.append(source_copy)
+        # Score all documents in one vectorized pass
+        scores = score_sources(get_scoring_index(loaded_sources), unique_terms)
+        passing = np.flatnonzero(scores >= float(match_threshold))
 
-        logger.info(f"DEBUG: {len(scored_sources)} documents passed threshold")
+        # Rank by score (stable, so equal scores keep pack.json order), sorting only the likely top up front
+        # Selection works on source indices; Match tuples are built only for the final documents
+        scored_sources = LazyRanking(loaded_sources, scores, passing, int(max_sources) * RANK_OVERSAMPLE)
 
-        # Sort by score
-        scored_sources.sort(key=lambda x: x['match_score'], reverse=True)
+        logger.info(f"DEBUG: {len(passing)} documents passed threshold")
 
         # Intelligent source selection - prioritize company mentioned in question
         matches = []
@@ -598,39 +876,39 @@ def find_matching_documents(user_question, topics, loaded_sources, base_url, max
         if company_specific:
             logger.info("DEBUG: Prioritizing Lennar documents for company-specific question")
             # Add Lennar documents first
-            for source in scored_sources:
+            for i, source in scored_sources:
                 if len(matches) >= int(max_sources):
                     break
                 if "Lennar" in source['file_name']:
-                    if len(matches) >= 2 and chars_so_far + len(source['text']) > int(max_characters):
+                    if len(matches) >= 2 and chars_so_far + source['text_len'] > int(max_characters):
                         break
-                    matches.append(source)
-                    chars_so_far += len(source['text'])
+                    matches.append(i)
+                    chars_so_far += source['text_len']
                     has_lennar = True
         elif company_specific_meritage:
             logger.info("DEBUG: Prioritizing Meritage documents for company-specific question")
             # Add Meritage documents first
-            for source in scored_sources:
+            for i, source in scored_sources:
                 if len(matches) >= int(max_sources):
                     break
                 if "Meritage" in source['file_name']:
-                    if len(matches) >= 2 and chars_so_far + len(source['text']) > int(max_characters):
+                    if len(matches) >= 2 and chars_so_far + source['text_len'] > int(max_characters):
                         break
-                    matches.append(source)
-                    chars_so_far += len(source['text'])
+                    matches.append(i)
+                    chars_so_far += source['text_len']
                     has_meritage = True
 
         # Second pass: fill remaining slots with best matches regardless of company
-        for source in scored_sources:
+        for i, source in scored_sources:
             if len(matches) >= int(max_sources):
                 break
 
             # Skip if already added
-            if source in matches:
+            if i in matches:
                 continue
 
             # Check character limit (but ensure minimum docs)
-            if len(matches) >= 2 and chars_so_far + len(source['text']) > int(max_characters):
+            if len(matches) >= 2 and chars_so_far + source['text_len'] > int(max_characters):
                 break
 
             # Track companies
@@ -639,32 +917,32 @@ def find_matching_documents(user_question, topics, loaded_sources, base_url, max
             elif "Meritage" in source['file_name']:
                 has_meritage = True
 
-            matches.append(source)
-            chars_so_far += len(source['text'])
+            matches.append(i)
+            chars_so_far += source['text_len']
 
         # Third pass: ensure both companies if comparing
         if (wants_comparison or mentions_both) and len(matches) < int(max_sources):
             if not has_lennar:
-                for source in scored_sources:
-                    if "Lennar" in source['file_name'] and source not in matches:
-                        matches.append(source)
+                for i, source in scored_sources:
+                    if "Lennar" in source['file_name'] and i not in matches:
+                        matches.append(i)
                         logger.info("DEBUG: Added Lennar doc for comparison")
                         break
             if not has_meritage:
-                for source in scored_sources:
-                    if "Meritage" in source['file_name'] and source not in matches:
-                        matches.append(source)
+                for i, source in scored_sources:
+                    if "Meritage" in source['file_name'] and i not in matches:
+                        matches.append(i)
                         logger.info("DEBUG: Added Meritage doc for comparison")
                         break
 
         logger.info(f"DEBUG: Selected {len(matches)} final documents")
         if matches:
-            lennar_count = sum(1 for m in matches if "Lennar" in m['file_name'])
-            meritage_count = sum(1 for m in matches if "Meritage" in m['file_name'])
+            lennar_count = sum(1 for i in matches if "Lennar" in loaded_sources[i]['file_name'])
+            meritage_count = sum(1 for i in matches if "Meritage" in loaded_sources[i]['file_name'])
             logger.info(f"DEBUG: Lennar: {lennar_count}, Meritage: {meritage_count}")
-            logger.info(f"DEBUG: Top scores: {[round(m['match_score'], 3) for m in matches[:3]]}")
+            logger.info(f"DEBUG: Top scores: {[round(float(scores[i]), 3) for i in matches[:3]]}")
 
-        return [SimpleNamespace(**match) for match in matches]
+        return [make_match(loaded_sources[i], float(scores[i])) for i in matches]
 
     except Exception as e:
         logger.error(f"ERROR: Document matching failed: {e}")
@@ -672,37 +950,45 @@ def find_matching_documents(user_question, topics, loaded_sources, base_url, max
         logger.error(f"ERROR: Full traceback: {traceback.format_exc()}")
         raise e
 
-def calculate_simple_relevance(text, search_terms):
-    """Enhanced relevance scoring for competitive intelligence documents"""
-    text_lower = text.lower()
+# Domain-specific keywords for real estate competitive intelligence: (group, score per keyword present, keywords, logged)
+SIMPLE_KEYWORD_GROUPS = [
+    ('financing', 0.15, ['financing', 'mortgage', 'loan', 'apr', 'rate', 'payment', 'buydown', 'interest', 'closing cost', 'incentive', 'promotion', 'offer', 'special', 'event', 'sale', 'monthly payment'], True),
+    ('pricing', 0.1, ['price', 'pricing', 'cost', '$', 'from', 'starting', 'base', 'reduction', 'discount'], True),
+    ('inventory', 0.08, ['available', 'inventory', 'move-in ready', 'quick move', 'homes', 'communities', 'floor plan', 'model'], False),
+    ('competitor', 0.2, ['lennar', 'meritage', 'dr horton', 'pulte', 'kb home', 'taylor morrison'], True),
+]
+
+# Every keyword in scoring order, so all groups are counted in one pass over the text
+_SIMPLE_KEYWORD_ENTRIES = [(group, weight, keyword, logged)
+                           for group, weight, keywords, logged in SIMPLE_KEYWORD_GROUPS for keyword in keywords]
+_SIMPLE_KEYWORDS = [keyword for _, _, keyword, _ in _SIMPLE_KEYWORD_ENTRIES]
+
+# Important domain words that earn a higher per-word score
+_BOOSTED_WORDS = frozenset(['financing', 'mortgage', 'special', 'promotion', 'rate', 'payment', 'lennar', 'meritage', 'apr', 'buydown'])
+
+def count_up_to(text, substring, cap):
+    """min(text.count(substring), cap) for a non-empty substring, without scanning past the cap-th occurrence"""
+    found = 0
+    pos = text.find(substring)
+    while pos >= 0:
+        found += 1
+        if found == cap:
+            break
+        pos = text.find(substring, pos + len(substring))
+    return found
+
+def calculate_simple_relevance(text_lower, search_terms):
+    """Enhanced relevance scoring for competitive intelligence documents (expects lowercased text)"""
     score = 0.0
     debug_matches = []
 
-    # Domain-specific keywords for real estate competitive intelligence
-    financing_keywords = ['financing', 'mortgage', 'loan', 'apr', 'rate', 'payment', 'buydown', 'interest', 'closing cost', 'incentive', 'promotion', 'offer', 'special', 'event', 'sale', 'monthly payment']
-    pricing_keywords = ['price', 'pricing', 'cost', '$', 'from', 'starting', 'base', 'reduction', 'discount']
-    inventory_keywords = ['available', 'inventory', 'move-in ready', 'quick move', 'homes', 'communities', 'floor plan', 'model']
-    competitor_keywords = ['lennar', 'meritage', 'dr horton', 'pulte', 'kb home', 'taylor morrison']
-
     # Check for domain-specific content first
-    for keyword in financing_keywords:
-        if keyword in text_lower:
-            score += 0.15
-            debug_matches.append(f"financing:{keyword}")
-
-    for keyword in pricing_keywords:
-        if keyword in text_lower:
-            score += 0.1
-            debug_matches.append(f"pricing:{keyword}")
-
-    for keyword in inventory_keywords:
-        if keyword in text_lower:
-            score += 0.08
-
-    for keyword in competitor_keywords:
-        if keyword in text_lower:
-            score += 0.2
-            debug_matches.append(f"competitor:{keyword}")
+    keyword_counts = count_substrings([text_lower], _SIMPLE_KEYWORDS)[0]
+    for (group, weight, keyword, logged), count in zip(_SIMPLE_KEYWORD_ENTRIES, keyword_counts):
+        if count:
+            score += weight
+            if logged:
+                debug_matches.append(f"{group}:{keyword}")
 
     # Now check search terms with enhanced matching
     for term in search_terms:
@@ -713,7 +999,7 @@ def calculate_simple_relevance(text, search_terms):
 
         # Check for exact phrase matches first (highest priority)
         if term_lower in text_lower:
-            occurrences = text_lower.count(term_lower)
+            occurrences = count_up_to(text_lower, term_lower, 2)
             phrase_score = min(occurrences * 0.5, 1.0)  # Strong boost for exact phrases
             score += phrase_score
             continue
@@ -731,20 +1017,20 @@ def calculate_simple_relevance(text, search_terms):
             # Check for partial matches and synonyms
             if word in text_lower:
                 matched_words += 1
-                occurrences = text_lower.count(word)
 
-                # Boost important domain words
-                if word in ['financing', 'mortgage', 'special', 'promotion', 'rate', 'payment', 'lennar', 'meritage', 'apr', 'buydown']:
-                    base_score = 0.4
+                # Boost important domain words; counting stops at the occurrence that reaches the 0.6 cap
+                if word in _BOOSTED_WORDS:
+                    base_score, cap = 0.4, 2
                 elif len(word) >= 7:  # Long words are usually specific
-                    base_score = 0.25
+                    base_score, cap = 0.25, 3
                 else:
-                    base_score = 0.15
+                    base_score, cap = 0.15, 4
 
+                occurrences = count_up_to(text_lower, word, cap)
                 word_score = min(occurrences * base_score, 0.6)
                 term_total_score += word_score
-            # Also check for common variations
-            elif any(variation in text_lower for variation in [word + 's', word + 'ing', word + 'ed', word[:-1] if word.endswith('s') else word]):
+            # Also check for common variations; word + 's'/'ing'/'ed' contain word, so only the singular can still match
+            elif word.endswith('s') and word[:-1] in text_lower:
                 matched_words += 1
                 term_total_score += 0.1
 
@@ -763,92 +1049,416 @@ def calculate_simple_relevance(text, search_terms):
 
     # Debug logging for high-scoring matches
     if final_score > 0.3 and debug_matches:
-        logger.debug(f"MATCH SCORE {final_score:.3f}: Found keywords: {debug_matches[:5]}")
+        logger.debug("MATCH SCORE %.3f: Found keywords: %s", final_score, debug_matches[:5])
 
     return final_score
 
 
-def calculate_enhanced_relevance(text, search_terms, file_name):
-    """Enhanced relevance scoring optimized for competitive intelligence"""
-    text_lower = text.lower()
-    score = 0.0
+# Domain scoring
+# Critical keywords and high-value patterns don't depend on the question: keyword counts are
+# aggregated by _score_corpus when the scoring index is built, and pattern hits are kept in the index.
+
+CRITICAL_KEYWORDS = {
+    # Financing
+    'apr': 0.5, 'rate': 0.4, 'buydown': 0.6, 'mortgage': 0.4, 'financing': 0.5,
+    'payment': 0.3, 'monthly': 0.3, '2.99%': 0.8, '5.572%': 0.8,
+
+    # Promotions
+    'special': 0.5, 'event': 0.4, 'promotion': 0.5, 'limited': 0.4, 'offer': 0.4,
+    'sale': 0.4, 'national': 0.3, 'incentive': 0.5,
+
+    # Pricing
+    'price': 0.4, 'reduction': 0.5, 'reduced': 0.5, 'discount': 0.5,
+    '$': 0.3, 'cost': 0.3,
+
+    # Inventory
+    'available': 0.3, 'inventory': 0.4, 'move-in': 0.4, 'ready': 0.3,
+
+    # Competitors
+    'lennar': 0.3, 'meritage': 0.3
+}
+
+HIGH_VALUE_PATTERNS = [
+    ('national sales event', 0.8),
+    ('special financing', 0.7),
+    ('2.99% apr', 0.9),
+    ('limited time', 0.5),
+    ('move-in ready', 0.5),
+    ('price reduction', 0.6)
+]
+
+# Aggressive keyword expansion applied when a question mentions one of the keys
+KEYWORD_EXPANSIONS = {
+    'financing': ['financing', 'finance', 'mortgage', 'loan', 'apr', 'rate', 'payment', 'buydown',
+                 'interest', 'monthly payment', 'qualification', 'credit', '2.99%', '5.572%'],
+    'special': ['special', 'promotion', 'offer', 'event', 'sale', 'limited time', 'exclusive',
+               'discount', 'incentive', 'deal', 'savings', 'national sales event'],
+    'price': ['price', 'pricing', 'cost', '$', 'reduction', 'reduced', 'discount', 'drop',
+             'decrease', 'lower', 'affordable', 'starting from'],
+    'inventory': ['inventory', 'available', 'availability', 'move-in ready', 'quick move',
+                 'homes available', 'in stock', 'ready now']
+}
+
+# Competitor terms added for company-specific and comparison questions
+COMPETITOR_TERMS = ['lennar', 'meritage']
+
+# Question words that ask for a comparison of both competitors
+COMPARISON_WORDS = ('competitors', 'competition', 'both', 'compare', 'versus', 'vs')
+
+# Lowercased expansion terms per keyword, so a query takes a set union instead of a dedup loop
+_EXPANSION_SETS = {key: frozenset(term.lower() for term in terms) for key, terms in KEYWORD_EXPANSIONS.items()}
+
+# Every term the expansion step can add, mapped to its column in the scoring index
+SEARCH_VOCAB = {
+    term: idx for idx, term in enumerate(dict.fromkeys(
+        term.lower() for terms in list(KEYWORD_EXPANSIONS.values()) + [COMPETITOR_TERMS] for term in terms
+    ))
+}
+
+# Alphanumeric runs of lowercased text; query words made only of these characters are counted from tokens
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Scoring index for the source list currently being searched, keyed by sources_key()
+_SCORING_INDEX_CACHE = {}
+
+# Embedding index for the source list currently being searched, keyed by sources_key()
+_EMBEDDING_INDEX_CACHE = {}
+EMBEDDING_MODEL = 'text-embedding-ada-002'
+EMBEDDING_BATCH_SIZE = 96
+EMBEDDING_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'embeddings.npz')
+# Aho-Corasick automatons keyed by their pattern tuple
+_AUTOMATON_CACHE = {}
+_AUTOMATON_CACHE_SIZE = 64
+
+_DOMAIN_TERMS = list(CRITICAL_KEYWORDS)
+_DOMAIN_WEIGHTS = np.array([CRITICAL_KEYWORDS[k] for k in _DOMAIN_TERMS], dtype=np.float64)
+# Keywords followed by patterns, counted together in one pass
+_DOMAIN_PATTERNS = _DOMAIN_TERMS + [pattern for pattern, _ in HIGH_VALUE_PATTERNS]
+
+
+def _score_corpus(counts_mat, weights):
+    """Domain score per chunk: keyword counts capped at 3 times their weights, summed in keyword order"""
+    scores = np.zeros(counts_mat.shape[0], dtype=np.float64)
+    # One column at a time keeps each chunk's additions in the scalar scorer's order
+    for k in range(counts_mat.shape[1]):
+        scores += np.minimum(counts_mat[:, k], 3) * weights[k]
+    return scores
+
+
+def _self_overlapping(pattern):
+    """True when pattern can overlap itself, where Aho-Corasick and str.count disagree"""
+    return any(pattern[:k] == pattern[-k:] for k in range(1, len(pattern)))
+
+
+def get_automaton(patterns):
+    """Return a cached Aho-Corasick automaton mapping each pattern to its position in patterns"""
+    key = tuple(patterns)
+    automaton = _AUTOMATON_CACHE.get(key)
+    if automaton is None:
+        automaton = ahocorasick.Automaton()
+        for idx, pattern in enumerate(key):
+            automaton.add_word(pattern, idx)
+        automaton.make_automaton()
+        if len(_AUTOMATON_CACHE) >= _AUTOMATON_CACHE_SIZE:
+            _AUTOMATON_CACHE.clear()
+        _AUTOMATON_CACHE[key] = automaton
+    return automaton
+
+
+def count_substrings(texts_lower, patterns):
+    """Occurrences of each pattern in each text as an (n_texts, n_patterns) array, matching str.count"""
+    unique = list(dict.fromkeys(patterns))
+    counts = np.zeros((len(texts_lower), len(unique)), dtype=np.int64)
+
+    # One pass per text for every pattern Aho-Corasick counts exactly; the rest use str.count
+    ac_cols = []
+    if _AHOCORASICK_AVAILABLE:
+        ac_cols = [j for j, pattern in enumerate(unique) if pattern and not _self_overlapping(pattern)]
+    automaton = get_automaton([unique[j] for j in ac_cols]) if ac_cols else None
+
+    ac_set = set(ac_cols)
+    for i, text in enumerate(texts_lower):
+        if automaton is not None:
+            hits = [idx for _, idx in automaton.iter(text)]
+            if hits:
+                counts[i, ac_cols] = np.bincount(hits, minlength=len(ac_cols))
+        for j, pattern in enumerate(unique):
+            if j not in ac_set:
+                counts[i, j] = text.count(pattern)
+
+    if len(unique) == len(patterns):
+        return counts
+    position = {pattern: j for j, pattern in enumerate(unique)}
+    return counts[:, [position[pattern] for pattern in patterns]]
+
+
+def domain_counts(text_lower):
+    """Count domain keyword and high-value pattern occurrences in lowercased text"""
+    counts = count_substrings([text_lower], _DOMAIN_PATTERNS)[0]
+    return counts[:len(_DOMAIN_TERMS)].tolist(), counts[len(_DOMAIN_TERMS):].tolist()
+
+
+def domain_scores(texts_lower):
+    """Question-independent critical-keyword score of every text, as an array
+
+    High-value patterns are added after the search terms, so they are kept in the scoring index instead.
+    """
+    counts_mat = count_substrings(texts_lower, _DOMAIN_TERMS).astype(np.int32)
+    return _score_corpus(counts_mat, _DOMAIN_WEIGHTS)
+
+
+def term_contributions(term_lower, count_of):
+    """One search term's score contributions, in the order calculate_enhanced_relevance adds them
 
-    # Critical keywords with weights
-    critical_keywords = {
-        # Financing
-        'apr': 0.5, 'rate': 0.4, 'buydown': 0.6, 'mortgage': 0.4, 'financing': 0.5,
-        'payment': 0.3, 'monthly': 0.3, '2.99%': 0.8, '5.572%': 0.8,
+    count_of(substring) returns occurrences as a count or a per-document array. Contributions that don't apply
+    are 0.0, which leaves a score unchanged, so adding them one by one matches the scalar sum exactly.
+    """
+    # Exact phrase match (high value)
+    phrase_count = np.asarray(count_of(term_lower) if len(term_lower) > 3 else 0)
+    phrase = phrase_count > 0
+    contributions = [np.where(phrase, np.minimum(phrase_count * 0.6, 1.5), 0.0)]
+
+    # Word matching, only where the phrase didn't match
+    words = term_lower.split()
+    matched = 0
+    for word in words:
+        if len(word) < 3:
+            continue
+        found = ~phrase & (np.asarray(count_of(word)) > 0)
+        matched = matched + found
+        contributions.append(np.where(found, CRITICAL_KEYWORDS.get(word, 0.15), 0.0))
+
+    # Completeness bonus
+    if len(words) > 1:
+        contributions.append(np.where(matched / len(words) >= 0.7, 0.3, 0.0))
+    return contributions
+
+
+def term_substrings(term_lower):
+    """Substrings term_contributions counts for one lowercased search term"""
+    substrings = [term_lower] if len(term_lower) > 3 else []
+    substrings.extend(word for word in term_lower.split() if len(word) >= 3)
+    return substrings
+
+
+def build_token_index(texts_lower):
+    """Postings of every alphanumeric token: which texts contain it and how often"""
+    counters = [Counter(_TOKEN_RE.findall(text)) for text in texts_lower]
+    postings = {}
+    for doc, counter in enumerate(counters):
+        for token, count in counter.items():
+            postings.setdefault(token, []).append((doc, count))
+
+    vocab = list(postings)
+    ptr = np.zeros(len(vocab) + 1, dtype=np.intp)
+    ptr[1:] = np.cumsum([len(postings[token]) for token in vocab])
+    return SimpleNamespace(
+        n_docs=len(texts_lower),
+        vocab=vocab,
+        ptr=ptr,
+        docs=np.array([doc for token in vocab for doc, _ in postings[token]], dtype=np.intp),
+        counts=np.array([count for token in vocab for _, count in postings[token]], dtype=np.int64)
+    )
 
-        # Promotions
-        'special': 0.5, 'event': 0.4, 'promotion': 0.5, 'limited': 0.4, 'offer': 0.4,
-        'sale': 0.4, 'national': 0.3, 'incentive': 0.5,
 
-        # Pricing
-        'price': 0.4, 'reduction': 0.5, 'reduced': 0.5, 'discount': 0.5,
-        '$': 0.3, 'cost': 0.3,
+def token_counts(token_index, word):
+    """str.count of an alphanumeric word in every text, summed over the tokens that contain it
+
+    Exact because an alphanumeric word can only occur inside a single token; cost scales with the vocabulary
+    rather than with the corpus size.
+    """
+    token_ids = [tid for tid, token in enumerate(token_index.vocab) if word in token]
+    if not token_ids:
+        return np.zeros(token_index.n_docs, dtype=np.int64)
+    starts, stops = token_index.ptr[token_ids], token_index.ptr[np.array(token_ids) + 1]
+    rows = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])
+    per_token = np.repeat([token_index.vocab[tid].count(word) for tid in token_ids], stops - starts)
+    return np.bincount(token_index.docs[rows], weights=token_index.counts[rows] * per_token,
+                       minlength=token_index.n_docs).astype(np.int64)
 
-        # Inventory
-        'available': 0.3, 'inventory': 0.4, 'move-in': 0.4, 'ready': 0.3,
 
-        # Competitors
-        'lennar': 0.3, 'meritage': 0.3
+def corpus_counter(texts_lower, substrings=(), token_index=None):
+    """Return count_of(substring) giving occurrences in every text as an array, memoized per substring
+
+    substrings known up front are counted together in one pass over each text, or looked up in token_index
+    when they are plain alphanumeric words.
+    """
+    counts = {}
+    substrings = list(dict.fromkeys(substrings))
+    if token_index is not None:
+        for substring in substrings:
+            if _TOKEN_RE.fullmatch(substring):
+                counts[substring] = token_counts(token_index, substring)
+        substrings = [substring for substring in substrings if substring not in counts]
+    if substrings and texts_lower:
+        # A substring can only occur in texts containing each of its words, so texts missing a word counted above
+        # are skipped
+        rows = np.zeros(len(texts_lower), dtype=bool)
+        for substring in substrings:
+            candidates = np.ones(len(texts_lower), dtype=bool)
+            for word in _TOKEN_RE.findall(substring):
+                if word in counts:
+                    candidates &= counts[word] > 0
+            rows |= candidates
+        rows = np.flatnonzero(rows)
+        precounted = np.zeros((len(texts_lower), len(substrings)), dtype=np.int64)
+        if len(rows):
+            precounted[rows] = count_substrings([texts_lower[i] for i in rows], substrings)
+        counts.update((substring, precounted[:, j]) for j, substring in enumerate(substrings))
+
+    def count_of(substring):
+        if substring not in counts:
+            counts[substring] = np.fromiter((text.count(substring) for text in texts_lower),
+                                            dtype=np.int64, count=len(texts_lower))
+        return counts[substring]
+
+    return count_of
+
+
+def build_scoring_index(loaded_sources):
+    """Precompute the per-source arrays needed to score every source in one vectorized pass"""
+    texts_lower = [source['text'].lower() for source in loaded_sources]
+
+    # Contributions of every vocabulary term against every source, so expanded terms become row lookups;
+    # all-zero rows are dropped since adding them changes nothing
+    patterns = [pattern for pattern, _ in HIGH_VALUE_PATTERNS]
+    count_of = corpus_counter(texts_lower, [sub for term in SEARCH_VOCAB for sub in term_substrings(term)] + patterns)
+    vocab_contributions = {
+        term: [row for row in term_contributions(term, count_of) if row.any()] for term in SEARCH_VOCAB
     }
 
-    # Check critical keywords
-    for keyword, weight in critical_keywords.items():
-        if keyword in text_lower:
-            count = min(text_lower.count(keyword), 3)  # Cap contribution
-            score += count * weight
+    file_names_lower = list(dict.fromkeys(source['file_name'].lower() for source in loaded_sources))
+    file_idx = {name: i for i, name in enumerate(file_names_lower)}
+
+    logger.info(f"DEBUG: Built scoring index for {len(loaded_sources)} sources over {len(SEARCH_VOCAB)} terms")
+    return SimpleNamespace(
+        sources=loaded_sources,
+        texts_lower=texts_lower,
+        domain_scores=domain_scores(texts_lower),
+        vocab_contributions=vocab_contributions,
+        pattern_hits=np.array([count_of(pattern) > 0 for pattern in patterns], dtype=bool).reshape(len(patterns), -1),
+        tokens=build_token_index(texts_lower),
+        file_names_lower=file_names_lower,
+        file_codes=np.array([file_idx[source['file_name'].lower()] for source in loaded_sources], dtype=np.intp)
+    )
 
-    # Check search terms
-    for term in search_terms:
-        if not term:
-            continue
 
-        term_lower = term.lower()
+def sources_key(loaded_sources):
+    """Index cache key that changes when a source is added, removed or replaced, or its indexed fields are edited"""
+    return tuple((id(source), source['text'], source['file_name'], source['chunk_index']) for source in loaded_sources)
 
-        # Exact phrase match (high value)
-        if len(term_lower) > 3 and term_lower in text_lower:
-            occurrences = text_lower.count(term_lower)
-            score += min(occurrences * 0.6, 1.5)
-            continue
 
-        # Word matching
-        words = term_lower.split()
-        matched = 0
+def get_scoring_index(loaded_sources):
+    """Return the scoring index for loaded_sources, rebuilding it whenever their content changes"""
+    key = sources_key(loaded_sources)
+    index = _SCORING_INDEX_CACHE.get(key)
+    if index is None:
+        index = build_scoring_index(loaded_sources)
+        _SCORING_INDEX_CACHE.clear()
+        _SCORING_INDEX_CACHE[key] = index
+        pack_key = pack_version()
+        if pack_key is not None and _PACK_CACHE[pack_key] is loaded_sources:
+            save_index_snapshot(pack_key, loaded_sources, index)
+    return index
+
+
+def load_index_snapshot(pack_key):
+    """Return (loaded_sources, scoring index) saved for pack_key, or None when there is no usable snapshot
+
+    Only snapshots owned by the current user are unpickled, since the temp directory may be shared.
+    """
+    try:
+        with open(INDEX_SNAPSHOT_PATH, 'rb') as f:
+            if hasattr(os, 'getuid') and os.fstat(f.fileno()).st_uid != os.getuid():
+                logger.warning(f"DEBUG: Ignoring index snapshot not owned by this user: {INDEX_SNAPSHOT_PATH}")
+                return None
+            snapshot = pickle.load(f)
+        if snapshot['key'] != (INDEX_SNAPSHOT_VERSION, pack_key):
+            return None
+        return snapshot['sources'], snapshot['index']
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug("DEBUG: Could not read index snapshot %s: %s", INDEX_SNAPSHOT_PATH, e)
+        return None
+
+
+def save_index_snapshot(pack_key, loaded_sources, index):
+    """Pickle loaded_sources and their scoring index for pack_key, replacing any older snapshot atomically"""
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(INDEX_SNAPSHOT_PATH), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'key': (INDEX_SNAPSHOT_VERSION, pack_key), 'sources': loaded_sources, 'index': index}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, INDEX_SNAPSHOT_PATH)
+    except Exception as e:
+        logger.debug("DEBUG: Could not write index snapshot %s: %s", INDEX_SNAPSHOT_PATH, e)
 
-        for word in words:
-            if len(word) < 3:
-                continue
-            if word in text_lower:
-                matched += 1
-                if word in critical_keywords:
-                    score += critical_keywords[word]
-                else:
-                    score += 0.15
 
-        # Completeness bonus
-        if len(words) > 1 and matched / len(words) >= 0.7:
-            score += 0.3
+def score_sources(index, search_terms):
+    """calculate_enhanced_relevance for every source at once, returned as an array aligned with the sources
+
+    Contributions are added in the scalar scorer's order, so scores match it exactly.
+    """
+    score = index.domain_scores.copy()
+
+    # Expanded terms reuse precomputed vocabulary contributions; anything else is counted across the corpus
+    terms_lower = [term.lower() for term in search_terms if term]
+    dynamic_terms = [term_lower for term_lower in terms_lower if term_lower not in index.vocab_contributions]
+    if dynamic_terms:
+        count_of = corpus_counter(index.texts_lower, [sub for term in dynamic_terms for sub in term_substrings(term)],
+                                  index.tokens)
+    for term_lower in terms_lower:
+        contributions = index.vocab_contributions.get(term_lower)
+        if contributions is None:
+            contributions = term_contributions(term_lower, count_of)
+        for contribution in contributions:
+            score += contribution
 
     # High-value patterns
-    high_value_patterns = [
-        ('national sales event', 0.8),
-        ('special financing', 0.7),
-        ('2.99% apr', 0.9),
-        ('limited time', 0.5),
-        ('move-in ready', 0.5),
-        ('price reduction', 0.6)
-    ]
+    for (_, weight), hits in zip(HIGH_VALUE_PATTERNS, index.pattern_hits):
+        score += np.where(hits, weight, 0.0)
+
+    # File name bonus
+    file_bonus = np.array([
+        0.2 if any(term and term.lower() in name for term in search_terms) else 0.0
+        for name in index.file_names_lower
+    ], dtype=np.float64)
+    score += file_bonus[index.file_codes]
+
+    # Normalize
+    return np.minimum(score / 3.0, 1.0)
+
+
+def calculate_enhanced_relevance(text_lower, search_terms, file_name_lower, domain_score=None):
+    """Enhanced relevance scoring optimized for competitive intelligence (expects lowercased text and file name)
 
-    for pattern, weight in high_value_patterns:
-        if pattern in text_lower:
+    domain_score is the source's precomputed critical-keyword score, when available.
+    """
+    keyword_counts, pattern_counts = domain_counts(text_lower)
+
+    # Critical keywords
+    if domain_score is None:
+        domain_score = _score_corpus(np.array([keyword_counts], dtype=np.int32), _DOMAIN_WEIGHTS)[0]
+    score = float(domain_score)
+
+    # Check search terms; phrase scores cap at 3 occurrences and words only need one
+    def count_of(substring):
+        return count_up_to(text_lower, substring, 3)
+
+    for term in search_terms:
+        if term:
+            for contribution in term_contributions(term.lower(), count_of):
+                score += float(contribution)
+
+    # High-value patterns
+    for (_, weight), count in zip(HIGH_VALUE_PATTERNS, pattern_counts):
+        if count:
             score += weight
 
     # File name bonus
-    file_lower = file_name.lower()
     for term in search_terms:
-        if term and term.lower() in file_lower:
+        if term and term.lower() in file_name_lower:
             score += 0.2
             break
 
@@ -856,32 +1466,37 @@ def calculate_enhanced_relevance(text, search_terms, file_name):
     return min(score / 3.0, 1.0)
 
 
+# Keywords that mark a line worth quoting in the fallback response
+_RELEVANT_KEYWORDS = ('$', 'price', 'apr', 'rate', 'payment', 'special', 'event', 'promotion',
+                      'financing', 'mortgage', 'buydown', 'available', 'move-in')
+_RELEVANT_LINE_RE = re.compile('|'.join(map(re.escape, _RELEVANT_KEYWORDS)))
+FALLBACK_MAX_LINES = 5
+
+# Prompt facts for one source; blocks are joined with a blank line between them
+_FACT_BLOCK = "====== Source {number} ====\nFile and page: {file_name} page {page}\nDescription: {description}\nCitation: {url}\nContent: {text}\n"
+
 def generate_rag_response(user_question, docs):
     """Generate response using LLM with document context"""
     if not docs:
         return None
     
-    # Build facts from documents for LLM prompt
+    # Build facts from documents for LLM prompt, one formatted block per document
     facts = []
     logger.info(f"DEBUG: Building prompt from {len(docs)} documents")
     for i, doc in enumerate(docs):
-        facts.append(f"====== Source {i+1} ====")
-        facts.append(f"File and page: {doc.file_name} page {doc.chunk_index}")
-        facts.append(f"Description: {doc.description}")
-        facts.append(f"Citation: {doc.url}")
-        facts.append(f"Content: {doc.text}")
-        facts.append("")
-        logger.debug(f"DEBUG: Added source {i+1}: {doc.file_name} p{doc.chunk_index} ({len(doc.text)} chars)")
+        facts.append(_FACT_BLOCK.format(number=i + 1, file_name=doc.file_name, page=doc.chunk_index,
+                                        description=doc.description, url=doc.url, text=doc.text))
+        logger.debug("DEBUG: Added source %d: %s p%s (%d chars)", i + 1, doc.file_name, doc.chunk_index, len(doc.text))
     
     # Create the prompt for the LLM
-    prompt_template = Template(narrative_prompt)
-    full_prompt = prompt_template.render(
+    full_prompt = _NARRATIVE_TPL.render(
         user_query=user_question,
         facts="\n".join(facts)
     )
     logger.info(f"DEBUG: Generated prompt length: {len(full_prompt)} chars")
-    logger.debug(f"DEBUG: Prompt preview: {full_prompt[:500]}...")
+    logger.debug("DEBUG: Prompt preview: %.500s...", full_prompt)
     
+    llm_failed = False
     try:
         # Use ArUtils for LLM calls like other skills do
         logger.info("DEBUG: Making LLM call with ArUtils")
@@ -890,7 +1505,7 @@ def generate_rag_response(user_question, docs):
         llm_response = ar_utils.get_llm_response(full_prompt)
         
         logger.info(f"DEBUG: Got LLM response length: {len(llm_response)} chars")
-        logger.info(f"DEBUG: LLM response preview: {llm_response[:200]}...")
+        logger.debug("DEBUG: LLM response preview: %.200s...", llm_response)
         
         # Parse the LLM response like the old doc_search code
         def get_between_tags(content, tag):
@@ -903,15 +1518,16 @@ def generate_rag_response(user_question, docs):
         title = get_between_tags(llm_response, "title") or f"Analysis: {user_question}"
         content = get_between_tags(llm_response, "content") or llm_response
         
-        logger.info(f"DEBUG: Parsed title: {title[:50]}...")
-        logger.info(f"DEBUG: Parsed content: {content[:100]}...")
+        logger.debug("DEBUG: Parsed title: %.50s...", title)
+        logger.debug("DEBUG: Parsed content: %.100s...", content)
         
     except Exception as e:
         logger.error(f"DEBUG: ArUtils LLM call failed: {e}")
+        llm_failed = True
         logger.info(f"DEBUG: Using fallback response generation")
         # Fallback with better extraction of actual content
         title = f"Competitive Intelligence: {user_question}"
-        content = f"<p>Based on the competitive intelligence documents, here's the relevant information:</p>"
+        parts = ["<p>Based on the competitive intelligence documents, here's the relevant information:</p>"]
 
         # Extract and present actual data from documents
         for i, doc in enumerate(docs):
@@ -925,18 +1541,20 @@ def generate_rag_response(user_question, docs):
                 relevant_lines = []
 
                 for line in lines:
-                    line_lower = line.lower()
                     # Extract lines with important information
-                    if any(keyword in line_lower for keyword in ['$', 'price', 'apr', 'rate', 'payment', 'special', 'event', 'promotion', 'financing', 'mortgage', 'buydown', 'available', 'move-in']):
+                    if _RELEVANT_LINE_RE.search(line.lower()):
                         relevant_lines.append(line.strip())
+                        # Only the top 5 lines are shown
+                        if len(relevant_lines) >= FALLBACK_MAX_LINES:
+                            break
 
                 if relevant_lines:
-                    content += f"<h3>From {doc.file_name} (Page {doc.chunk_index})<sup>[{i+1}]</sup></h3>"
-                    content += "<ul>"
-                    for line in relevant_lines[:5]:  # Show top 5 most relevant lines
-                        if line:
-                            content += f"<li>{line}</li>"
-                    content += "</ul>"
+                    parts.append(f"<h3>From {doc.file_name} (Page {doc.chunk_index})<sup>[{i+1}]</sup></h3>")
+                    parts.append("<ul>")
+                    parts.extend(f"<li>{line}</li>" for line in relevant_lines)
+                    parts.append("</ul>")
+
+        content = "".join(parts)
     
     # Build references with actual URLs and thumbnails
     references = []
@@ -949,24 +1567,9 @@ def generate_rag_response(user_question, docs):
         preview_text = doc_text[:120] + "..." if len(doc_text) > 120 else doc_text
         
         # Generate thumbnail for this document (for references section)
-        logger.info(f"DEBUG: Generating thumbnail for reference {i+1}: {doc.file_name} page {doc.chunk_index}")
+        logger.debug("DEBUG: Generating thumbnail for reference %d: %s page %s", i + 1, doc.file_name, doc.chunk_index)
         thumbnail_base64 = get_pdf_thumbnail(pack_file_path, doc.file_name, doc.chunk_index, 120, 160)
         
-        # Generate correct knowledge base URLs with proper document IDs
-        logger.info(f"DEBUG URL: ==> Generating URL for: {doc.file_name}")
-
-        # Map file names to their actual knowledge base IDs
-        if "Lennar" in doc.file_name:
-            doc_id = "abb40c5f-f259-48bf-85c3-d2ed1ea956b8"
-        elif "Meritage" in doc.file_name:
-            doc_id = "7f0292db-d935-4c90-b65b-897bb98167f9"
-        else:
-            # Fallback for unknown documents
-            doc_id = "unknown"
-
-        doc.url = f"https://dreamfinders.poc.answerrocket.com/apps/system/knowledge-base/{doc_id}#page={doc.chunk_index}"
-        logger.info(f"DEBUG URL: ==> Generated URL: {doc.url}")
-        
         ref = {
             'number': i + 1,
             'url': doc.url,
@@ -982,37 +1585,38 @@ def generate_rag_response(user_question, docs):
         'title': title,
         'content': content,
         'references': references,
-        'raw_prompt': full_prompt  # For debugging
+        'raw_prompt': full_prompt,  # For debugging
+        'llm_failed': llm_failed
     }
 
+# Ampersands that don't already start an HTML entity
+_BARE_AMP_RE = re.compile(r'&(?!amp;|lt;|gt;|quot;|apos;|#\d+;|#x[0-9a-fA-F]+;)')
+
+# Control characters other than \n, \r and \t
+_CONTROL_CHARS_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
 def force_ascii_replace(html_string):
     """Clean HTML string for safe rendering"""
     # Remove null characters
     cleaned = html_string.replace('\u0000', '')
     
     # Escape special characters, but preserve existing HTML entities
-    cleaned = re.sub(r'&(?!amp;|lt;|gt;|quot;|apos;|#\d+;|#x[0-9a-fA-F]+;)', '&amp;', cleaned)
+    cleaned = _BARE_AMP_RE.sub('&amp;', cleaned)
     
     # Replace problematic characters with HTML entities
     cleaned = cleaned.replace('"', '&quot;')
     cleaned = cleaned.replace("'", '&#39;')
-    cleaned = cleaned.replace('–', '&ndash;')
-    cleaned = cleaned.replace('—', '&mdash;')
-    cleaned = cleaned.replace('…', '&hellip;')
-    
-    # Convert curly quotes to straight quotes
-    cleaned = cleaned.replace('"', '"').replace('"', '"')
-    cleaned = cleaned.replace(''', "'").replace(''', "'")
+    cleaned = cleaned.replace('\u2013', '&ndash;')
+    cleaned = cleaned.replace('\u2014', '&mdash;')
+    cleaned = cleaned.replace('\u2026', '&hellip;')
     
     # Remove any remaining control characters
-    cleaned = ''.join(ch for ch in cleaned if ord(ch) >= 32 or ch in '\n\r\t')
-    
-    return cleaned
+    return _CONTROL_CHARS_RE.sub('', cleaned)
 
 # OpenAI Embedding Functions
 
-def get_openai_embedding(text: str) -> List[float]:
-    """Get OpenAI embedding using the platform's embedding service"""
+def get_openai_embedding(text: str) -> np.ndarray:
+    """Get OpenAI embedding using the platform's embedding service, as a float32 vector"""
     try:
         from ar_analytics import ArUtils
         ar_utils = ArUtils()
@@ -1022,19 +1626,19 @@ def get_openai_embedding(text: str) -> List[float]:
 
         for method_name in embedding_methods:
             if hasattr(ar_utils, method_name):
-                logger.info(f"DEBUG: Found ArUtils embedding method: {method_name}")
+                logger.debug("DEBUG: Found ArUtils embedding method: %s", method_name)
                 method = getattr(ar_utils, method_name)
                 try:
                     result = method(text)
-                    if isinstance(result, list) and len(result) > 0:
-                        logger.info(f"DEBUG: Got embedding from ArUtils.{method_name}, dimension: {len(result)}")
-                        return result
+                    if isinstance(result, (list, np.ndarray)) and len(result) > 0:
+                        logger.debug("DEBUG: Got embedding from ArUtils.%s, dimension: %d", method_name, len(result))
+                        return np.asarray(result, dtype=np.float32)
                 except Exception as e:
                     logger.warning(f"DEBUG: ArUtils.{method_name} failed: {e}")
                     continue
 
         # Try platform-specific embedding APIs
-        logger.info("DEBUG: Trying platform embedding service directly")
+        logger.debug("DEBUG: Trying platform embedding service directly")
 
         # Try using requests to call the platform's embedding endpoint
         import requests
@@ -1058,19 +1662,19 @@ def get_openai_embedding(text: str) -> List[float]:
             'model': 'text-embedding-ada-002'
         }
 
-        logger.info(f"DEBUG: Calling platform embedding API: {embedding_url}")
+        logger.debug("DEBUG: Calling platform embedding API: %s", embedding_url)
         response = requests.post(embedding_url, json=payload, headers=headers, timeout=30)
 
         if response.status_code == 200:
             result = response.json()
             if 'embedding' in result:
                 embedding = result['embedding']
-                logger.info(f"DEBUG: Got embedding from platform API, dimension: {len(embedding)}")
-                return embedding
+                logger.debug("DEBUG: Got embedding from platform API, dimension: %d", len(embedding))
+                return np.asarray(embedding, dtype=np.float32)
             elif 'data' in result and len(result['data']) > 0:
                 embedding = result['data'][0]['embedding']
-                logger.info(f"DEBUG: Got embedding from platform API (data format), dimension: {len(embedding)}")
-                return embedding
+                logger.debug("DEBUG: Got embedding from platform API (data format), dimension: %d", len(embedding))
+                return np.asarray(embedding, dtype=np.float32)
         else:
             logger.warning(f"DEBUG: Platform embedding API returned {response.status_code}: {response.text}")
 
@@ -1084,25 +1688,124 @@ def get_openai_embedding(text: str) -> List[float]:
         logger.error(f"ERROR: Failed to get embedding: {e}")
         raise e
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    """Calculate cosine similarity between two vectors"""
+def normalize_embedding(embedding):
+    """Embedding as an L2-normalized float32 vector (all zeros stays all zeros)"""
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+def get_openai_embeddings(texts):
+    """Embed texts in batches of EMBEDDING_BATCH_SIZE through the platform API
+
+    Returns one float32 embedding (or None on failure) per text; batches the API rejects fall back to
+    get_openai_embedding per text.
+    """
+    import requests
+
+    base_url = os.environ.get("AR_BACKEND_BASE_URL", "http://localhost:8080")
+    embedding_url = f"{base_url}/api/embeddings"
+    headers = {
+        'Content-Type': 'application/json',
+        'Tenant': os.environ.get('AR_TENANT_ID', 'dreamfinders'),
+        'Max-Authorization': 'Max-Internal'
+    }
+
+    embeddings = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+        batch_embeddings = None
+        try:
+            payload = {'input': [text.replace("\n", " ") for text in batch], 'model': EMBEDDING_MODEL}
+            logger.debug("DEBUG: Calling platform embedding API for %d texts: %s", len(batch), embedding_url)
+            response = requests.post(embedding_url, json=payload, headers=headers, timeout=60)
+            if response.status_code == 200:
+                data = response.json().get('data') or []
+                if len(data) == len(batch):
+                    batch_embeddings = [np.asarray(item['embedding'], dtype=np.float32)
+                                        for item in sorted(data, key=lambda item: item.get('index', 0))]
+            else:
+                logger.warning(f"DEBUG: Batch embedding API returned {response.status_code}: {response.text}")
+        except Exception as e:
+            logger.warning(f"DEBUG: Batch embedding request failed: {e}")
+
+        if batch_embeddings is None:
+            batch_embeddings = []
+            for text in batch:
+                try:
+                    batch_embeddings.append(get_openai_embedding(text))
+                except Exception as e:
+                    logger.warning(f"DEBUG: Failed to embed document: {e}")
+                    batch_embeddings.append(None)
+        embeddings.extend(batch_embeddings)
+    return embeddings
+
+def embedding_key(source):
+    """Disk cache key of a source's embedding: file, page and a hash of the text"""
+    text_hash = hashlib.sha1(source['text'].encode('utf-8')).hexdigest()
+    return f"{EMBEDDING_MODEL}|{source['file_name']}|{source['chunk_index']}|{text_hash}"
+
+def load_or_build_embeddings(loaded_sources, cache_path):
+    """Normalized embedding per source (None when it failed), reusing vectors cached in cache_path"""
+    cached = {}
     try:
-        a_array = np.array(a)
-        b_array = np.array(b)
+        with np.load(cache_path, allow_pickle=False) as data:
+            cached = dict(zip(data['keys'].tolist(), data['vectors']))
+    except (OSError, KeyError, ValueError) as e:
+        logger.debug("DEBUG: No usable embedding cache at %s: %s", cache_path, e)
+
+    keys = [embedding_key(source) for source in loaded_sources]
+    misses = [i for i, key in enumerate(keys) if key not in cached]
+    logger.info(f"DEBUG: {len(keys) - len(misses)} cached embeddings, embedding {len(misses)} documents")
+    if misses:
+        for i, embedding in zip(misses, get_openai_embeddings([loaded_sources[i]['text'] for i in misses])):
+            if embedding is not None:
+                cached[keys[i]] = normalize_embedding(embedding)
+
+        # Persist only vectors of the dominant dimension, written atomically
+        dims = [vec.shape[0] for vec in cached.values()]
+        if dims:
+            dim = max(set(dims), key=dims.count)
+            keep = [key for key, vec in cached.items() if vec.shape[0] == dim]
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, keys=np.array(keep), vectors=np.stack([cached[key] for key in keep]))
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.debug("DEBUG: Could not write embedding cache %s: %s", cache_path, e)
 
-        dot_product = np.dot(a_array, b_array)
-        norm_a = np.linalg.norm(a_array)
-        norm_b = np.linalg.norm(b_array)
+    return [cached.get(key) for key in keys]
 
-        if norm_a == 0 or norm_b == 0:
-            return 0.0
+def build_embedding_index(loaded_sources):
+    """Embed every source once into an (N, D) float32 matrix of L2-normalized rows
 
-        similarity = dot_product / (norm_a * norm_b)
-        return float(similarity)
+    Sources whose embedding fails are left as zero rows and flagged invalid so they never match.
+    """
+    rows = load_or_build_embeddings(loaded_sources, EMBEDDING_CACHE_PATH)
+    valid = np.array([row is not None for row in rows], dtype=bool)
+
+    dims = [row.shape[0] for row in rows if row is not None]
+    dim = max(set(dims), key=dims.count) if dims else 0
+    matrix = np.zeros((len(loaded_sources), dim), dtype=np.float32)
+    for i, row in enumerate(rows):
+        if row is not None and row.shape[0] == dim:
+            matrix[i] = row
+        else:
+            valid[i] = False
 
-    except Exception as e:
-        logger.error(f"ERROR: Failed to calculate cosine similarity: {e}")
-        return 0.0
+    logger.info(f"DEBUG: Built embedding index for {int(valid.sum())}/{len(loaded_sources)} sources, dimension {dim}")
+    return SimpleNamespace(sources=loaded_sources, matrix=matrix, valid=valid)
+
+def get_embedding_index(loaded_sources):
+    """Return the embedding index for loaded_sources, rebuilding it whenever their content changes"""
+    key = sources_key(loaded_sources)
+    index = _EMBEDDING_INDEX_CACHE.get(key)
+    if index is None:
+        index = build_embedding_index(loaded_sources)
+        _EMBEDDING_INDEX_CACHE.clear()
+        _EMBEDDING_INDEX_CACHE[key] = index
+    return index
 
 def find_matches_with_openai_embeddings(user_question, topics, loaded_sources, match_threshold, max_sources, max_characters):
     """Find document matches using OpenAI embeddings"""
@@ -1114,66 +1817,39 @@ def find_matches_with_openai_embeddings(user_question, topics, loaded_sources, m
         if topics:
             search_query += " " + " ".join(topics)
 
-        logger.info(f"DEBUG: Getting embedding for search query: {search_query[:100]}...")
+        logger.debug("DEBUG: Getting embedding for search query: %.100s...", search_query)
 
         # Get embedding for search query
         query_embedding = get_openai_embedding(search_query)
         logger.info(f"DEBUG: Got query embedding, dimension: {len(query_embedding)}")
 
-        # Calculate similarities for all sources
-        matches = []
-        for i, source in enumerate(loaded_sources):
-            if i % 20 == 0:  # Log progress every 20 documents
-                logger.info(f"DEBUG: Processing document {i+1}/{len(loaded_sources)}")
-
-            try:
-                # Get embedding for document text
-                doc_embedding = get_openai_embedding(source['text'])
-
-                # Calculate similarity
-                similarity = cosine_similarity(query_embedding, doc_embedding)
+        # Cosine similarity against every source at once (rows and query are unit length)
+        index = get_embedding_index(loaded_sources)
+        query_vec = normalize_embedding(query_embedding)
+        if query_vec.shape[0] != index.matrix.shape[1]:
+            raise ValueError(f"Query embedding dimension {query_vec.shape[0]} does not match index dimension {index.matrix.shape[1]}")
+        similarities = index.matrix @ query_vec
+        passing = np.flatnonzero(index.valid & (similarities >= float(match_threshold)))
+        logger.debug("DEBUG: %d documents passed similarity threshold", len(passing))
 
-                if similarity >= float(match_threshold):
-                    source_copy = source.copy()
-                    source_copy['match_score'] = similarity
-
-                    # Generate correct knowledge base URLs with proper document IDs
-                    if "Lennar" in source_copy['file_name']:
-                        doc_id = "abb40c5f-f259-48bf-85c3-d2ed1ea956b8"
-                    elif "Meritage" in source_copy['file_name']:
-                        doc_id = "7f0292db-d935-4c90-b65b-897bb98167f9"
-                    else:
-                        doc_id = "unknown"
-                    source_copy['url'] = f"https://dreamfinders.poc.answerrocket.com/apps/system/knowledge-base/{doc_id}#page={source_copy['chunk_index']}"
-
-                    matches.append(source_copy)
-                    logger.info(f"DEBUG: Found match with similarity {similarity:.3f}: {source_copy['file_name']} page {source_copy['chunk_index']}")
-
-            except Exception as e:
-                logger.warning(f"DEBUG: Failed to process document {i}: {e}")
-                continue
-
-        # Sort by similarity score (descending)
-        matches.sort(key=lambda x: x['match_score'], reverse=True)
-
-        # Select top matches respecting character limit
+        # Select top matches by similarity (descending) respecting character limit
         final_matches = []
         chars_so_far = 0
 
-        for match in matches:
+        for i, source in LazyRanking(loaded_sources, similarities, passing, int(max_sources)):
             if len(final_matches) >= int(max_sources):
                 break
 
             # Always include at least 2 documents if available, then respect character limit
-            if len(final_matches) >= 2 and chars_so_far + len(match['text']) > int(max_characters):
+            if len(final_matches) >= 2 and chars_so_far + source['text_len'] > int(max_characters):
                 break
 
-            final_matches.append(match)
-            chars_so_far += len(match['text'])
+            final_matches.append(make_match(source, float(similarities[i])))
+            chars_so_far += source['text_len']
 
         logger.info(f"DEBUG: Selected {len(final_matches)} final matches with embeddings")
         if final_matches:
-            logger.info(f"DEBUG: Top similarity scores: {[m['match_score'] for m in final_matches[:3]]}")
+            logger.debug("DEBUG: Top similarity scores: %s", [m.match_score for m in final_matches[:3]])
 
         return final_matches
 
@@ -1275,7 +1951,7 @@ sources_template = """
             <div style="display: flex; align-items: flex-start;">
                 <div style="flex-shrink: 0; margin-right: 16px;">
                     {% if ref.thumbnail %}
-                    <img src="data:image/png;base64,{{ ref.thumbnail }}" alt="Document thumbnail" style="width: 80px; height: 120px; border-radius: 8px; border: 1px solid #e2e8f0; object-fit: cover; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
+                    <img src="data:image/jpeg;base64,{{ ref.thumbnail }}" alt="Document thumbnail" style="width: 80px; height: 120px; border-radius: 8px; border: 1px solid #e2e8f0; object-fit: cover; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
                     {% else %}
                     <div style="width: 80px; height: 120px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); border-radius: 8px; display: flex; align-items: center; justify-content: center; color: white; font-weight: 600; font-size: 18px; box-shadow: 0 2px 8px rgba(102, 126, 234, 0.3);">
                         {{ ref.number }}
@@ -1319,6 +1995,13 @@ sources_template = """
     }
 </style>"""
 
+# Compile templates once at import instead of on every request. String templates keep
+# autoescape off, matching how they rendered as plain Template objects.
+_JINJA_ENV = Environment(autoescape=select_autoescape(['html'], default_for_string=False))
+_NARRATIVE_TPL = _JINJA_ENV.from_string(narrative_prompt)
+_MAIN_TPL = _JINJA_ENV.from_string(main_response_template)
+_SOURCES_TPL = _JINJA_ENV.from_string(sources_template)
+
 if __name__ == '__main__':
     skill_input = document_rag_explorer.create_input(
         arguments={
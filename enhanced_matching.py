@@ -1,5 +1,418 @@
 # Enhanced keyword matching for competitive intelligence
 
+from collections import Counter, namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+
+try:
+    import ahocorasick
+    _AHOCORASICK_AVAILABLE = True
+except ImportError:
+    _AHOCORASICK_AVAILABLE = False
+
+# High-value competitive intelligence keywords
+CRITICAL_KEYWORDS = {
+    # Financing terms
+    'apr': 0.5, 'rate': 0.4, 'buydown': 0.6, 'mortgage': 0.4, 'financing': 0.5,
+    'payment': 0.3, 'monthly': 0.3, 'qualification': 0.3, 'credit': 0.3,
+
+    # Promotional terms
+    'special': 0.5, 'event': 0.4, 'promotion': 0.5, 'limited': 0.4, 'offer': 0.4,
+    'sale': 0.4, 'national': 0.3, 'exclusive': 0.4, 'incentive': 0.5,
+
+    # Pricing terms
+    'price': 0.4, 'reduction': 0.5, 'reduced': 0.5, 'discount': 0.5,
+    '$': 0.3, 'cost': 0.3, 'affordable': 0.3, 'starting': 0.3,
+
+    # Inventory terms
+    'available': 0.3, 'inventory': 0.4, 'move-in': 0.4, 'ready': 0.3,
+    'quick': 0.3, 'immediate': 0.3,
+
+    # Competitor names
+    'lennar': 0.3, 'meritage': 0.3
+}
+
+# Special patterns that indicate high relevance
+HIGH_VALUE_PATTERNS = [
+    ('national sales event', 0.8),
+    ('special financing', 0.7),
+    ('limited time', 0.5),
+    ('move-in ready', 0.5),
+    ('price reduction', 0.6),
+    ('apr buydown', 0.8),
+    ('closing cost', 0.5),
+    ('monthly payment', 0.5)
+]
+
+# Keywords and patterns scored for every question; their per-document counts are kept in the match index
+STATIC_PATTERNS = list(dict.fromkeys(list(CRITICAL_KEYWORDS) + [pattern for pattern, _ in HIGH_VALUE_PATTERNS]))
+
+
+def _self_overlapping(pattern):
+    """True when pattern can overlap itself, where Aho-Corasick and str.count disagree"""
+    return any(pattern[:k] == pattern[-k:] for k in range(1, len(pattern)))
+
+
+def query_patterns(search_terms):
+    """Substrings calculate_enhanced_relevance counts for these (lowercased) search terms, beyond STATIC_PATTERNS"""
+    patterns = []
+    for term_lower in search_terms:
+        if term_lower:
+            if len(term_lower) > 3:
+                patterns.append(term_lower)
+            patterns.extend(word for word in term_lower.split() if len(word) >= 3)
+    static = set(STATIC_PATTERNS)
+    return [pattern for pattern in dict.fromkeys(patterns) if pattern not in static]
+
+
+def build_automaton(patterns):
+    """Aho-Corasick automaton over the patterns it counts exactly like str.count, or None without pyahocorasick"""
+    if not _AHOCORASICK_AVAILABLE:
+        return None
+    automaton = ahocorasick.Automaton()
+    for pattern in patterns:
+        if pattern and not _self_overlapping(pattern):
+            automaton.add_word(pattern, pattern)
+    if len(automaton) == 0:
+        return None
+    automaton.make_automaton()
+    return automaton
+
+
+def text_counter(text_lower, automaton, known_counts=None):
+    """Return count_of(pattern) for text_lower from one automaton pass, using str.count for patterns it lacks
+
+    Patterns in known_counts (such as counts already taken for STATIC_PATTERNS) are looked up instead of counted.
+    """
+    if known_counts is None:
+        known_counts = {}
+    counts = Counter(pattern for _, pattern in automaton.iter(text_lower)) if automaton is not None else {}
+
+    def count_of(pattern):
+        if pattern in known_counts:
+            return known_counts[pattern]
+        if pattern in counts:
+            return counts[pattern]
+        return 0 if automaton is not None and pattern in automaton else text_lower.count(pattern)
+
+    return count_of
+
+
+def static_pattern_counts(text_lower):
+    """Occurrences of every STATIC_PATTERNS entry in text_lower, zeros included"""
+    count_of = text_counter(text_lower, _STATIC_AUTOMATON)
+    return {pattern: count_of(pattern) for pattern in STATIC_PATTERNS}
+
+
+_STATIC_AUTOMATON = build_automaton(STATIC_PATTERNS)
+
+# Match index for the source list currently being searched, keyed by sources_key()
+_MATCH_INDEX_CACHE = {}
+
+# Company tags derived from each source's file name
+COMPANY_OTHER, COMPANY_LENNAR, COMPANY_MERITAGE = 0, 1, 2
+KB_DOC_IDS = {
+    COMPANY_LENNAR: "abb40c5f-f259-48bf-85c3-d2ed1ea956b8",
+    COMPANY_MERITAGE: "7f0292db-d935-4c90-b65b-897bb98167f9",
+    COMPANY_OTHER: "unknown"
+}
+KB_URL = "https://dreamfinders.poc.answerrocket.com/apps/system/knowledge-base/{doc_id}#page={page}"
+
+# Question substrings that ask about the competitors, or for both companies side by side
+COMPETITOR_WORDS = ('competitors', 'competition', 'both', 'compare')
+BOTH_WORDS = ('compare', 'versus', 'vs', 'and', 'both')
+
+# A source that passed the threshold, scored without copying its dict
+ScoredSource = namedtuple('ScoredSource', 'source match_score url company text_len')
+
+# Scores kept per match index, keyed by the query's search-term tuple
+SCORE_CACHE_SIZE = 256
+
+# Bits in each document's 3-gram Bloom filter; 4096 keeps false positives low for ~1k-char chunks
+QGRAM_BLOOM_BITS = 4096
+
+
+def qgram_bits(text_lower):
+    """Bloom bit positions of the UTF-8 byte 3-grams of text_lower"""
+    data = np.frombuffer(text_lower.encode(), dtype=np.uint8).astype(np.uint32)
+    grams = (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+    # Multiplicative hash; the top 12 bits pick the bit
+    return np.unique((grams * np.uint32(2654435761)) >> np.uint32(20))
+
+
+def qgram_bloom(text_lower):
+    """Bloom filter of the 3-grams of text_lower, packed into a uint64 array of QGRAM_BLOOM_BITS bits"""
+    bits = np.zeros(QGRAM_BLOOM_BITS, dtype=np.bool_)
+    bits[qgram_bits(text_lower)] = True
+    return np.packbits(bits).view(np.uint64)
+
+
+def bloom_candidates(blooms, patterns):
+    """(n_texts, n_patterns) mask of the patterns each text may contain; False means it certainly does not
+
+    blooms stacks the texts' packed filters (from qgram_bloom) as an (n_texts, QGRAM_BLOOM_BITS // 64) array.
+    """
+    candidates = np.empty((len(blooms), len(patterns)), dtype=np.bool_)
+    for j, pattern in enumerate(patterns):
+        # A text may contain the pattern only if its filter has every bit of the pattern's filter set
+        mask = qgram_bloom(pattern)
+        candidates[:, j] = ((blooms & mask) == mask).all(axis=1)
+    return candidates
+
+
+def count_matrix(texts_lower, patterns, automaton, candidates=None):
+    """Occurrences of each pattern in each text as an (n_texts, n_patterns) array, matching str.count
+
+    Cells where candidates (from bloom_candidates) is False are left at zero without scanning.
+    """
+    counts = np.zeros((len(texts_lower), len(patterns)), dtype=np.int64)
+    column = {pattern: j for j, pattern in enumerate(patterns)}
+    counted = [j for j, pattern in enumerate(patterns) if automaton is None or pattern not in automaton]
+    rows = range(len(texts_lower)) if candidates is None else np.flatnonzero(candidates.any(axis=1))
+    for i in rows:
+        text = texts_lower[i]
+        if automaton is not None:
+            for pattern, count in Counter(pattern for _, pattern in automaton.iter(text)).items():
+                counts[i, column[pattern]] = count
+        for j in counted:
+            if candidates is None or candidates[i, j]:
+                counts[i, j] = text.count(patterns[j])
+    return counts
+
+
+def build_match_index(loaded_sources):
+    """Precompute the question-independent per-document arrays used by score_documents
+
+    Everything derived from a source is kept here rather than stored on the caller's source dicts.
+    """
+    texts_lower = [source['text'].lower() for source in loaded_sources]
+    # Count the static keywords of each document once
+    static_counts = np.array([[counts[pattern] for pattern in STATIC_PATTERNS]
+                              for counts in map(static_pattern_counts, texts_lower)],
+                             dtype=np.int64).reshape(len(loaded_sources), len(STATIC_PATTERNS))
+    static_column = {pattern: j for j, pattern in enumerate(STATIC_PATTERNS)}
+
+    # Keyword scores summed in table order, exactly as calculate_enhanced_relevance adds them
+    keyword_scores = np.zeros(len(loaded_sources), dtype=np.float64)
+    for keyword, weight in CRITICAL_KEYWORDS.items():
+        keyword_scores += np.minimum(static_counts[:, static_column[keyword]] * weight, weight * 2)
+
+    companies = [COMPANY_LENNAR if "Lennar" in source['file_name']
+                 else COMPANY_MERITAGE if "Meritage" in source['file_name'] else COMPANY_OTHER
+                 for source in loaded_sources]
+    file_names_lower = list(dict.fromkeys(source['file_name'].lower() for source in loaded_sources))
+    file_idx = {name: i for i, name in enumerate(file_names_lower)}
+    return SimpleNamespace(
+        sources=loaded_sources,
+        texts_lower=texts_lower,
+        text_lens=[len(source['text']) for source in loaded_sources],
+        companies=companies,
+        static_counts=static_counts,
+        static_column=static_column,
+        keyword_scores=keyword_scores,
+        blooms=np.array([qgram_bloom(text_lower) for text_lower in texts_lower],
+                        dtype=np.uint64).reshape(len(loaded_sources), QGRAM_BLOOM_BITS // 64),
+        file_names_lower=file_names_lower,
+        file_codes=np.array([file_idx[source['file_name'].lower()] for source in loaded_sources], dtype=np.intp),
+        urls=[KB_URL.format(doc_id=KB_DOC_IDS[company], page=source['chunk_index'])
+              for source, company in zip(loaded_sources, companies)],
+        score_cache={}
+    )
+
+
+def sources_key(loaded_sources):
+    """Index cache key that changes when a source is added, removed or replaced, or its indexed fields are edited"""
+    return tuple((id(source), source['text'], source['file_name'], source['chunk_index']) for source in loaded_sources)
+
+
+def get_match_index(loaded_sources):
+    """Return the match index for loaded_sources, rebuilding it whenever their content changes"""
+    key = sources_key(loaded_sources)
+    index = _MATCH_INDEX_CACHE.get(key)
+    if index is None:
+        index = build_match_index(loaded_sources)
+        _MATCH_INDEX_CACHE.clear()
+        _MATCH_INDEX_CACHE[key] = index
+    return index
+
+
+def score_plan(index, search_terms):
+    """Encode the question side of calculate_enhanced_relevance as arrays over count-matrix columns
+
+    Columns below len(STATIC_PATTERNS) are index.static_counts; the rest are the query patterns returned alongside.
+    """
+    patterns = query_patterns(search_terms)
+    column = dict(index.static_column)
+    column.update((pattern, len(STATIC_PATTERNS) + j) for j, pattern in enumerate(patterns))
+
+    phrase_cols, word_ptr, n_words, word_cols, word_critical, word_weights = [], [0], [], [], [], []
+    for term_lower in search_terms:
+        if not term_lower:
+            continue
+        words = term_lower.split()
+        phrase_cols.append(column[term_lower] if len(term_lower) > 3 else -1)
+        for word in words:
+            if len(word) >= 3:
+                word_cols.append(column[word])
+                word_critical.append(word in CRITICAL_KEYWORDS)
+                word_weights.append(CRITICAL_KEYWORDS.get(word, 0.0))
+        word_ptr.append(len(word_cols))
+        n_words.append(len(words))
+
+    # File name bonus, one column per company in the order the scorer adds them
+    file_bonus = np.zeros((len(index.file_names_lower), 2), dtype=np.float64)
+    for k, company in enumerate(("lennar", "meritage")):
+        if any(company in str(t).lower() for t in search_terms):
+            file_bonus[:, k] = [0.2 if company in name else 0.0 for name in index.file_names_lower]
+
+    plan = SimpleNamespace(
+        phrase_cols=np.array(phrase_cols, dtype=np.int64),
+        word_ptr=np.array(word_ptr, dtype=np.int64),
+        n_words=np.array(n_words, dtype=np.int64),
+        word_cols=np.array(word_cols, dtype=np.int64),
+        word_critical=np.array(word_critical, dtype=np.bool_),
+        word_weights=np.array(word_weights, dtype=np.float64),
+        pattern_cols=np.array([column[pattern] for pattern, _ in HIGH_VALUE_PATTERNS], dtype=np.int64),
+        pattern_weights=np.array([weight for _, weight in HIGH_VALUE_PATTERNS], dtype=np.float64),
+        file_bonus=file_bonus[index.file_codes]
+    )
+    return plan, patterns
+
+
+def _aggregate_scores_py(keyword_scores, counts, phrase_cols, word_ptr, n_words, word_cols, word_critical,
+                         word_weights, pattern_cols, pattern_weights, file_bonus):
+    """Per-document calculate_enhanced_relevance arithmetic over a count matrix, in the scorer's order"""
+    n_docs = counts.shape[0]
+    scores = np.empty(n_docs, dtype=np.float64)
+    for i in range(n_docs):
+        score = keyword_scores[i]
+
+        # Check search terms
+        for t in range(phrase_cols.shape[0]):
+            # Exact phrase match (highest value)
+            if phrase_cols[t] >= 0 and counts[i, phrase_cols[t]] > 0:
+                score += min(counts[i, phrase_cols[t]] * 0.6, 1.5)
+                continue
+
+            # Word-by-word matching
+            matched_words = 0
+            for w in range(word_ptr[t], word_ptr[t + 1]):
+                occurrences = counts[i, word_cols[w]]
+                if occurrences > 0:
+                    matched_words += 1
+                    if word_critical[w]:
+                        score += word_weights[w] * min(occurrences, 3)
+                    else:
+                        score += min(occurrences * 0.15, 0.4)
+
+            # Completeness bonus
+            if n_words[t] > 1 and matched_words > 0:
+                completeness = matched_words / n_words[t]
+                if completeness >= 0.7:
+                    score += 0.3
+                elif completeness >= 0.5:
+                    score += 0.15
+
+        # Special patterns that indicate high relevance
+        for p in range(pattern_cols.shape[0]):
+            if counts[i, pattern_cols[p]] > 0:
+                score += pattern_weights[p]
+
+        # File name bonus
+        score += file_bonus[i, 0]
+        score += file_bonus[i, 1]
+
+        scores[i] = min(score / 3.0, 1.0)
+    return scores
+
+
+def _aggregate_columns(keyword_scores, counts, phrase_cols, word_ptr, n_words, word_cols, word_critical,
+                       word_weights, pattern_cols, pattern_weights, file_bonus):
+    """NumPy version of _aggregate_scores_py: one column operation per term, word and pattern for all documents"""
+    score = keyword_scores.copy()
+
+    # Check search terms; skipped contributions are added as 0.0, which leaves a score unchanged
+    for t in range(len(phrase_cols)):
+        if phrase_cols[t] >= 0:
+            occurrences = counts[:, phrase_cols[t]]
+            phrase_hit = occurrences > 0
+            score += np.where(phrase_hit, np.minimum(occurrences * 0.6, 1.5), 0.0)
+        else:
+            phrase_hit = np.zeros(len(score), dtype=np.bool_)
+
+        matched_words = np.zeros(len(score), dtype=np.int64)
+        for w in range(word_ptr[t], word_ptr[t + 1]):
+            occurrences = counts[:, word_cols[w]]
+            hit = (occurrences > 0) & ~phrase_hit
+            matched_words += hit
+            if word_critical[w]:
+                word_score = word_weights[w] * np.minimum(occurrences, 3)
+            else:
+                word_score = np.minimum(occurrences * 0.15, 0.4)
+            score += np.where(hit, word_score, 0.0)
+
+        if n_words[t] > 1:
+            completeness = matched_words / n_words[t]
+            score += np.where(matched_words > 0,
+                              np.where(completeness >= 0.7, 0.3, np.where(completeness >= 0.5, 0.15, 0.0)), 0.0)
+
+    for p in range(len(pattern_cols)):
+        score += np.where(counts[:, pattern_cols[p]] > 0, pattern_weights[p], 0.0)
+
+    score += file_bonus[:, 0]
+    score += file_bonus[:, 1]
+    return np.minimum(score / 3.0, 1.0)
+
+
+# Per-document scorer chosen by get_aggregate_scores on the first question
+_AGGREGATE_SCORES_CACHE = {}
+
+
+def get_aggregate_scores():
+    """Return _aggregate_scores_py compiled with numba, or _aggregate_columns when numba is not installed
+
+    numba is imported and the loop compiled on first use, so importing this module stays cheap. There is no
+    on-disk cache: one compile per process is cheap, and a cache written under another module name can't be loaded.
+    """
+    scorer = _AGGREGATE_SCORES_CACHE.get('scorer')
+    if scorer is None:
+        try:
+            import numba
+        except ImportError:
+            scorer = _aggregate_columns
+        else:
+            scorer = numba.njit(_aggregate_scores_py)
+        _AGGREGATE_SCORES_CACHE['scorer'] = scorer
+    return scorer
+
+
+def score_documents(index, search_terms):
+    """calculate_enhanced_relevance for every document at once, as an array aligned with index.sources
+
+    Contributions are added in the same order as the per-document scorer, so scores match it exactly.
+    Results are cached on the index per search-term tuple and returned read-only.
+    """
+    key = tuple(search_terms)
+    scores = index.score_cache.get(key)
+    if scores is not None:
+        return scores
+
+    plan, patterns = score_plan(index, search_terms)
+    # Only documents whose Bloom filter admits some query pattern are scanned
+    candidates = bloom_candidates(index.blooms, patterns)
+    query_counts = count_matrix(index.texts_lower, patterns, build_automaton(patterns), candidates)
+    counts = np.hstack((index.static_counts, query_counts))
+    args = (index.keyword_scores, counts, plan.phrase_cols, plan.word_ptr, plan.n_words, plan.word_cols,
+            plan.word_critical, plan.word_weights, plan.pattern_cols, plan.pattern_weights, plan.file_bonus)
+    scores = get_aggregate_scores()(*args)
+    scores.flags.writeable = False
+    if len(index.score_cache) >= SCORE_CACHE_SIZE:
+        index.score_cache.clear()
+    index.score_cache[key] = scores
+    return scores
+
+
 def enhanced_find_matching_documents(user_question, topics, loaded_sources, base_url, max_sources, match_threshold, max_characters):
     """Find documents using enhanced keyword matching optimized for competitive intelligence"""
     import logging
@@ -16,7 +429,7 @@ def enhanced_find_matching_documents(user_question, topics, loaded_sources, base
     mentions_lennar = "lennar" in question_lower
     mentions_meritage = "meritage" in question_lower
     mentions_both = mentions_lennar and mentions_meritage
-    mentions_competitors = any(word in question_lower for word in ["competitors", "competition", "both", "compare"])
+    mentions_competitors = any(word in question_lower for word in COMPETITOR_WORDS)
 
     # Build comprehensive search terms with synonyms
     search_terms = []
@@ -50,42 +463,31 @@ def enhanced_find_matching_documents(user_question, topics, loaded_sources, base
 
     search_terms.extend([topic for topic in topics if topic])
 
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_terms = []
-    for term in search_terms:
-        if term and term.lower() not in seen:
-            seen.add(term.lower())
-            unique_terms.append(term)
+    # Lowercase and remove duplicates while preserving order
+    unique_terms = list(dict.fromkeys(term.lower() for term in search_terms if term))
 
     logger.info(f"DEBUG: Expanded to {len(unique_terms)} unique search terms")
 
-    # Score all documents
-    scored_sources = []
-    for source in loaded_sources:
-        score = calculate_enhanced_relevance(source['text'], unique_terms, source['file_name'])
-
-        # Apply minimum threshold
-        if score >= float(match_threshold):
-            source_copy = source.copy()
-            source_copy['match_score'] = score
-
-            # Generate correct URLs
-            if "Lennar" in source_copy['file_name']:
-                doc_id = "abb40c5f-f259-48bf-85c3-d2ed1ea956b8"
-            elif "Meritage" in source_copy['file_name']:
-                doc_id = "7f0292db-d935-4c90-b65b-897bb98167f9"
-            else:
-                doc_id = "unknown"
+    max_sources = int(max_sources)
+    max_characters = int(max_characters)
 
-            source_copy['url'] = f"https://dreamfinders.poc.answerrocket.com/apps/system/knowledge-base/{doc_id}#page={source_copy['chunk_index']}"
-            scored_sources.append(source_copy)
+    # Score all documents in one vectorized pass
+    index = get_match_index(loaded_sources)
+    scores = score_documents(index, unique_terms)
+    # Apply minimum threshold and rank by score; the stable sort keeps ties in corpus order
+    passing = np.flatnonzero(scores >= float(match_threshold))
+    ranked = passing[np.argsort(-scores[passing], kind='stable')]
+    scored_sources = []
+    # Best-first sources of each company, for the second selection pass
+    company_ranked = {COMPANY_LENNAR: [], COMPANY_MERITAGE: [], COMPANY_OTHER: []}
+    for i in ranked:
+        # URLs, company tags and lengths are computed once per corpus in the match index
+        scored = ScoredSource(loaded_sources[i], float(scores[i]), index.urls[i], index.companies[i], index.text_lens[i])
+        scored_sources.append(scored)
+        company_ranked[scored.company].append(scored)
 
     logger.info(f"DEBUG: {len(scored_sources)} documents passed threshold of {match_threshold}")
 
-    # Sort by score
-    scored_sources.sort(key=lambda x: x['match_score'], reverse=True)
-
     # Intelligent source selection
     matches = []
     chars_so_far = 0
@@ -94,14 +496,14 @@ def enhanced_find_matching_documents(user_question, topics, loaded_sources, base
 
     # If asking about both or comparing, try to get at least one from each
     wants_both = mentions_both or mentions_competitors or \
-                any(word in question_lower for word in ['compare', 'versus', 'vs', 'and', 'both'])
+                any(word in question_lower for word in BOTH_WORDS)
 
     # First pass: get best matches respecting diversity if needed
-    for source in scored_sources:
-        if len(matches) >= int(max_sources):
+    for scored in scored_sources:
+        if len(matches) >= max_sources:
             break
 
-        if chars_so_far + len(source['text']) > int(max_characters):
+        if chars_so_far + scored.text_len > max_characters:
             # If we need both companies and don't have one yet, skip this and look for smaller docs
             if wants_both and len(matches) < 2 and (not has_lennar or not has_meritage):
                 continue
@@ -110,94 +512,71 @@ def enhanced_find_matching_documents(user_question, topics, loaded_sources, base
                 break
 
         # Track which companies we have
-        if "Lennar" in source['file_name']:
+        if scored.company == COMPANY_LENNAR:
             # Skip if we want only Meritage
             if mentions_meritage and not mentions_lennar and not mentions_both:
                 continue
             has_lennar = True
-        elif "Meritage" in source['file_name']:
+        elif scored.company == COMPANY_MERITAGE:
             # Skip if we want only Lennar
             if mentions_lennar and not mentions_meritage and not mentions_both:
                 continue
             has_meritage = True
 
-        matches.append(source)
-        chars_so_far += len(source['text'])
-
-    # Second pass: if we want both but missing one, find it
-    if wants_both and len(matches) < int(max_sources):
-        if not has_lennar:
-            for source in scored_sources:
-                if "Lennar" in source['file_name'] and source not in matches:
-                    matches.append(source)
-                    logger.info("DEBUG: Added Lennar doc to ensure both companies represented")
-                    break
-        if not has_meritage:
-            for source in scored_sources:
-                if "Meritage" in source['file_name'] and source not in matches:
-                    matches.append(source)
-                    logger.info("DEBUG: Added Meritage doc to ensure both companies represented")
-                    break
+        matches.append(scored)
+        chars_so_far += scored.text_len
+
+    # Second pass: if we want both but missing one, find it. A company still missing has no
+    # source in matches, so its best-scoring source is taken without a membership check
+    if wants_both and len(matches) < max_sources:
+        if not has_lennar and company_ranked[COMPANY_LENNAR]:
+            matches.append(company_ranked[COMPANY_LENNAR][0])
+            logger.info("DEBUG: Added Lennar doc to ensure both companies represented")
+        if not has_meritage and company_ranked[COMPANY_MERITAGE]:
+            matches.append(company_ranked[COMPANY_MERITAGE][0])
+            logger.info("DEBUG: Added Meritage doc to ensure both companies represented")
 
     logger.info(f"DEBUG: Selected {len(matches)} final documents")
     if matches:
-        lennar_count = sum(1 for m in matches if "Lennar" in m['file_name'])
-        meritage_count = sum(1 for m in matches if "Meritage" in m['file_name'])
+        lennar_count = sum(1 for m in matches if m.company == COMPANY_LENNAR)
+        meritage_count = sum(1 for m in matches if m.company == COMPANY_MERITAGE)
         logger.info(f"DEBUG: Distribution - Lennar: {lennar_count}, Meritage: {meritage_count}")
-        logger.info(f"DEBUG: Top scores: {[m['match_score'] for m in matches[:3]]}")
+        logger.info(f"DEBUG: Top scores: {[m.match_score for m in matches[:3]]}")
 
-    return [SimpleNamespace(**match) for match in matches]
+    # Only the selected sources are copied, with their score and URL
+    return [SimpleNamespace(**{**m.source, 'match_score': m.match_score, 'url': m.url}) for m in matches]
 
 
-def calculate_enhanced_relevance(text, search_terms, file_name):
-    """Enhanced relevance scoring optimized for competitive intelligence"""
+def calculate_enhanced_relevance(text_lower, search_terms, file_name, count_of=None):
+    """Enhanced relevance scoring optimized for competitive intelligence (expects lowercased text and terms)
+
+    count_of(substring) returns occurrences in text_lower; pass a text_counter to count everything in one pass.
+    """
     import logging
     logger = logging.getLogger(__name__)
 
-    text_lower = text.lower()
+    if count_of is None:
+        count_of = text_lower.count
     score = 0.0
     matches_found = []
 
-    # High-value competitive intelligence keywords
-    critical_keywords = {
-        # Financing terms
-        'apr': 0.5, 'rate': 0.4, 'buydown': 0.6, 'mortgage': 0.4, 'financing': 0.5,
-        'payment': 0.3, 'monthly': 0.3, 'qualification': 0.3, 'credit': 0.3,
-
-        # Promotional terms
-        'special': 0.5, 'event': 0.4, 'promotion': 0.5, 'limited': 0.4, 'offer': 0.4,
-        'sale': 0.4, 'national': 0.3, 'exclusive': 0.4, 'incentive': 0.5,
-
-        # Pricing terms
-        'price': 0.4, 'reduction': 0.5, 'reduced': 0.5, 'discount': 0.5,
-        '$': 0.3, 'cost': 0.3, 'affordable': 0.3, 'starting': 0.3,
-
-        # Inventory terms
-        'available': 0.3, 'inventory': 0.4, 'move-in': 0.4, 'ready': 0.3,
-        'quick': 0.3, 'immediate': 0.3,
-
-        # Competitor names
-        'lennar': 0.3, 'meritage': 0.3
-    }
 
     # Check for critical keywords first
-    for keyword, weight in critical_keywords.items():
-        if keyword in text_lower:
-            count = text_lower.count(keyword)
+    for keyword, weight in CRITICAL_KEYWORDS.items():
+        count = count_of(keyword)
+        if count:
             keyword_score = min(count * weight, weight * 2)  # Cap at 2x weight
             score += keyword_score
             matches_found.append(f"{keyword}({count})")
 
     # Check search terms
-    for term in search_terms:
-        if not term:
+    for term_lower in search_terms:
+        if not term_lower:
             continue
 
-        term_lower = term.lower()
-
         # Exact phrase match (highest value)
-        if len(term_lower) > 3 and term_lower in text_lower:
-            occurrences = text_lower.count(term_lower)
+        occurrences = count_of(term_lower) if len(term_lower) > 3 else 0
+        if occurrences:
             phrase_score = min(occurrences * 0.6, 1.5)
             score += phrase_score
             matches_found.append(f"exact:{term_lower}")
@@ -211,13 +590,13 @@ def calculate_enhanced_relevance(text, search_terms, file_name):
             if len(word) < 3:
                 continue
 
-            if word in text_lower:
+            occurrences = count_of(word)
+            if occurrences:
                 matched_words += 1
-                occurrences = text_lower.count(word)
 
                 # Boost important words
-                if word in critical_keywords:
-                    word_score = critical_keywords[word] * min(occurrences, 3)
+                if word in CRITICAL_KEYWORDS:
+                    word_score = CRITICAL_KEYWORDS[word] * min(occurrences, 3)
                 else:
                     word_score = min(occurrences * 0.15, 0.4)
 
@@ -232,19 +611,8 @@ def calculate_enhanced_relevance(text, search_terms, file_name):
                 score += 0.15
 
     # Special patterns that indicate high relevance
-    high_value_patterns = [
-        ('national sales event', 0.8),
-        ('special financing', 0.7),
-        ('limited time', 0.5),
-        ('move-in ready', 0.5),
-        ('price reduction', 0.6),
-        ('apr buydown', 0.8),
-        ('closing cost', 0.5),
-        ('monthly payment', 0.5)
-    ]
-
-    for pattern, weight in high_value_patterns:
-        if pattern in text_lower:
+    for pattern, weight in HIGH_VALUE_PATTERNS:
+        if count_of(pattern):
             score += weight
             matches_found.append(f"pattern:{pattern}")
 
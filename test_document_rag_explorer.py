@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+from skill_framework.layouts import wire_layout
+
+import document_rag_explorer
+
+QUESTION = "What special financing options does Lennar offer?"
+PACK_KEY = ('pack.json', 1, 100)
+CHANGED_PACK_KEY = ('pack.json', 2, 100)
+
+
+def skill_defaults():
+    """Default value of every skill parameter, by name"""
+    return {parameter.name: parameter.default_value for parameter in document_rag_explorer.document_rag_explorer.config.parameters}
+
+
+def serve(pack_key):
+    return document_rag_explorer.serve_question(QUESTION, "x", 5, 0.15, 3000, pack_key)
+
+
+@pytest.fixture
+def render_calls(monkeypatch):
+    """Count render_question calls behind an empty response cache"""
+    calls = []
+    render_question = document_rag_explorer.render_question
+
+    def counting_render_question(*args):
+        calls.append(args)
+        return render_question(*args)
+
+    monkeypatch.setattr(document_rag_explorer, 'render_question', counting_render_question)
+    monkeypatch.setattr(document_rag_explorer, '_RESPONSE_CACHE', OrderedDict())
+    return calls
+
+
+@pytest.fixture
+def llm_ok(monkeypatch):
+    """Answer every LLM call with a tagged response"""
+    ar_utils = SimpleNamespace(get_llm_response=lambda prompt: "<title>Financing</title><content>2.99% APR</content>")
+    monkeypatch.setitem(sys.modules, 'ar_analytics', SimpleNamespace(ArUtils=lambda: ar_utils))
+
+
+@pytest.fixture
+def llm_down(monkeypatch):
+    """Make the LLM import fail, so responses fall back to extracted text"""
+    monkeypatch.setitem(sys.modules, 'ar_analytics', None)
+
+
+def test_complete_response_is_cached(render_calls, llm_ok):
+    first = serve(PACK_KEY)
+    assert first[0] == "Financing"
+    assert serve(PACK_KEY) == first
+    assert len(render_calls) == 1
+
+
+def test_llm_failure_is_not_cached(render_calls, llm_down):
+    first = serve(PACK_KEY)
+    assert first[0].startswith("Competitive Intelligence:")
+    serve(PACK_KEY)
+    assert len(render_calls) == 2
+    assert not document_rag_explorer._RESPONSE_CACHE
+
+
+def test_changed_pack_misses_cache(render_calls, llm_ok):
+    serve(PACK_KEY)
+    serve(CHANGED_PACK_KEY)
+    assert len(render_calls) == 2
+    serve(PACK_KEY)
+    serve(CHANGED_PACK_KEY)
+    assert len(render_calls) == 2
+
+
+@pytest.mark.parametrize('parameter', ['response_layout', 'sources_layout'])
+def test_fast_wire_matches_wire_layout(parameter):
+    layout_str = skill_defaults()[parameter]
+    assert document_rag_explorer.compile_trivial_layout(layout_str) is not None
+    name = json.loads(layout_str)['inputVariables'][0]['name']
+
+    values = ["plain", "<div style=\"padding: 20px;\">\n\t<h2>Sources</h2>\n</div>", "quotes ' \" and \\ slashes",
+              "café — ✓ 🏠", "{{response_content}}", "", None]
+    for value in values:
+        expected = wire_layout(json.loads(layout_str), {name: value})
+        assert document_rag_explorer.fast_wire(layout_str, {name: value}) == expected, value
@@ -3,6 +3,13 @@
 import sys
 import os
 import logging
+import random
+
+import numpy as np
+import pytest
+
+import document_rag_explorer
+import enhanced_matching
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -36,9 +43,9 @@ def calculate_enhanced_relevance(text, search_terms, file_name):
 
     # Check critical keywords
     for keyword, weight in critical_keywords.items():
-        if keyword in text_lower:
-            count = min(text_lower.count(keyword), 3)  # Cap contribution
-            score += count * weight
+        count = text_lower.count(keyword)
+        if count:
+            score += min(count, 3) * weight  # Cap contribution
 
     # Check search terms
     for term in search_terms:
@@ -48,8 +55,8 @@ def calculate_enhanced_relevance(text, search_terms, file_name):
         term_lower = term.lower()
 
         # Exact phrase match (high value)
-        if len(term_lower) > 3 and term_lower in text_lower:
-            occurrences = text_lower.count(term_lower)
+        occurrences = text_lower.count(term_lower) if len(term_lower) > 3 else 0
+        if occurrences:
             score += min(occurrences * 0.6, 1.5)
             continue
 
@@ -232,6 +239,136 @@ def test_enhanced_matching():
     has_both = any('Lennar' in f for f in top_2_files_test1) and any('Meritage' in f for f in top_2_files_test1)
     print(f"Test 1 has both competitors in top 2: {has_both}")
 
+# Fixture corpus for the vectorized scorers: self-overlapping runs, short patterns and non-ASCII text
+fixture_texts = [
+    ('Lennar_Competitor_Analysis.pdf', 1, mock_sources[0]['text']),
+    ('Meritage_Market_Data.pdf', 2, mock_sources[1]['text']),
+    ('Generic_Market_Report.pdf', 3, mock_sources[2]['text']),
+    ('aa_notes.pdf', 1, 'aaaa aaa aa a $$$ $5 price reduction price reduction price reduction price reduction'),
+    ('aa_notes.pdf', 2, 'lolololol banana bananas nanana move-in ready move-in ready MOVE-IN READY'),
+    ('Meritage_Market_Data.pdf', 5, 'Limited time offer! Monthly payment from $1,999. Closing cost incentive, APR buydown.'),
+    ('Lennar_Competitor_Analysis.pdf', 7, 'Café au lait — prix réduit. Naïve résumé, café café.'),
+    ('Generic_Market_Report.pdf', 4, ''),
+    ('Generic_Market_Report.pdf', 5, 'financing financing financing financing mortgage rate rate rate rate 2.99% apr'),
+    ('Lennar_Competitor_Analysis.pdf', 9, 'The National Sales Event: sale, sale, sale. Inventory available now; quick move-in homes.'),
+]
+
+fixture_terms = ['aa', 'aaa', 'aaaa', 'a', '$', 'x', 'ab', 'lol', 'lolol', 'nana', 'banana', 'special financing',
+                 'financing', 'mortgage', 'move-in ready', 'price reduction', 'limited time offer', 'lennar', 'len',
+                 'meritage', 'mhi', 'café', 'prix réduit', 'closing cost', 'quick move', 'homes available',
+                 'What special financing options?', 'national sales event', 'sale', '2.99%', 'apr buydown', 'Rate']
+
+
+def fixture_sources():
+    """Source dicts shaped like load_document_sources() output"""
+    sources = []
+    for file_name, page, text in fixture_texts:
+        sources.append({
+            'file_name': file_name, 'file_name_lower': file_name.lower(), 'text': text, 'text_lower': text.lower(),
+            'text_len': len(text), 'description': text[:200], 'chunk_index': page, 'citation': file_name,
+            'url': f"https://example.com/{file_name}#page={page}"
+        })
+    return sources
+
+
+def fixture_term_sets(n=200):
+    rng = random.Random(0)
+    return [rng.sample(fixture_terms, rng.randint(1, 8)) for _ in range(n)]
+
+
+@pytest.fixture(params=['optional deps', 'pure python'])
+def scoring_mode(request, monkeypatch):
+    """Run a test with numba and pyahocorasick as installed, then with both patched out"""
+    if request.param == 'pure python':
+        monkeypatch.setattr(document_rag_explorer, '_AHOCORASICK_AVAILABLE', False)
+        monkeypatch.setattr(enhanced_matching, '_AHOCORASICK_AVAILABLE', False)
+        monkeypatch.setattr(enhanced_matching, '_STATIC_AUTOMATON', None)
+        monkeypatch.setitem(enhanced_matching._AGGREGATE_SCORES_CACHE, 'scorer', enhanced_matching._aggregate_columns)
+    # Indexes are cached by content, so each mode builds its own
+    monkeypatch.setattr(document_rag_explorer, '_SCORING_INDEX_CACHE', {})
+    monkeypatch.setattr(enhanced_matching, '_MATCH_INDEX_CACHE', {})
+    return request.param
+
+
+def test_substring_counts_match_str_count(scoring_mode):
+    texts = [text.lower() for _, _, text in fixture_texts]
+    patterns = list(dict.fromkeys(term.lower() for term in fixture_terms))
+    expected = np.array([[text.count(pattern) for pattern in patterns] for text in texts])
+
+    assert (document_rag_explorer.count_substrings(texts, patterns) == expected).all()
+
+    blooms = np.array([enhanced_matching.qgram_bloom(text) for text in texts])
+    candidates = enhanced_matching.bloom_candidates(blooms, patterns)
+    # The Bloom prefilter may admit extra texts but never drops one that contains the pattern
+    assert candidates[expected > 0].all()
+    counts = enhanced_matching.count_matrix(texts, patterns, enhanced_matching.build_automaton(patterns), candidates)
+    assert (counts == expected).all()
+
+
+def test_score_sources_matches_scalar_scorer(scoring_mode):
+    sources = fixture_sources()
+    index = document_rag_explorer.get_scoring_index(sources)
+    for terms in fixture_term_sets():
+        scores = document_rag_explorer.score_sources(index, terms)
+        expected = [calculate_enhanced_relevance(source['text'], terms, source['file_name']) for source in sources]
+        assert scores.tolist() == expected, terms
+
+
+def test_score_documents_matches_scalar_scorer(scoring_mode):
+    sources = fixture_sources()
+    index = enhanced_matching.get_match_index(sources)
+    for terms in fixture_term_sets():
+        terms = list(dict.fromkeys(term.lower() for term in terms))
+        scores = enhanced_matching.score_documents(index, terms)
+        expected = [enhanced_matching.calculate_enhanced_relevance(source['text'].lower(), terms, source['file_name'])
+                    for source in sources]
+        assert scores.tolist() == expected, terms
+
+
+def scalar_ranking(scores, threshold):
+    """Indices scoring at least threshold, best first, ties in corpus order"""
+    return sorted((i for i, score in enumerate(scores) if score >= threshold), key=lambda i: -scores[i])
+
+
+def test_find_matching_documents_ranks_like_scalar_scorer(scoring_mode):
+    sources = fixture_sources()
+    # No company, comparison or expansion keywords, so the search terms are the question plus topics
+    question = 'Tell me about aa'
+    for topics in fixture_term_sets(50):
+        topics = [topic for topic in dict.fromkeys(topic.lower() for topic in topics) if topic != question.lower()]
+        terms = [question] + topics
+        scores = [calculate_enhanced_relevance(source['text'], terms, source['file_name']) for source in sources]
+        expected = [(sources[i]['file_name'], sources[i]['chunk_index'], scores[i]) for i in scalar_ranking(scores, 0.05)]
+
+        matches = document_rag_explorer.find_matching_documents(question, topics, sources, 'x', len(sources), 0.05, 10 ** 9)
+        assert [(m.file_name, m.chunk_index, m.match_score) for m in matches] == expected, topics
+
+
+def test_enhanced_find_matching_documents_ranks_like_scalar_scorer(scoring_mode):
+    sources = fixture_sources()
+    question = 'Tell me about aa'
+    for topics in fixture_term_sets(50):
+        terms = list(dict.fromkeys(term.lower() for term in [question] + topics))
+        scores = [enhanced_matching.calculate_enhanced_relevance(source['text'].lower(), terms, source['file_name'])
+                  for source in sources]
+        expected = [(sources[i]['file_name'], sources[i]['chunk_index'], scores[i]) for i in scalar_ranking(scores, 0.05)]
+
+        matches = enhanced_matching.enhanced_find_matching_documents(question, topics, sources, 'x', len(sources), 0.05,
+                                                                     10 ** 9)
+        assert [(m.file_name, m.chunk_index, m.match_score) for m in matches] == expected, topics
+
+
+def test_lazy_ranking_matches_full_sort():
+    rng = random.Random(0)
+    sources = list(range(40))
+    for k in (0, 1, 3, 10, 40, 100):
+        # Few distinct values, so ties straddle the k-th score
+        scores = np.array([rng.choice([0.1, 0.2, 0.3, 0.5]) for _ in sources])
+        candidates = np.flatnonzero(scores >= 0.2)
+        ranking = document_rag_explorer.LazyRanking(sources, scores, candidates, k)
+        assert [i for i, _ in ranking] == sorted(candidates.tolist(), key=lambda i: -scores[i])
+
+
 if __name__ == "__main__":
     test_company_prioritization()
     print()